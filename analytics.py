@@ -0,0 +1,203 @@
+import os
+import threading
+
+import numpy as np
+
+import snapshot
+import storage
+from papers import LRUCache
+
+# Response codes stored per question, one byte each, in question-bank order.
+NOT_PRESENTED = 0   # pool tests: the question was not on this student's paper
+UNANSWERED = 1
+FIRST_OPTION = 2    # 2 + index of the chosen option in the bank's option order
+
+# Share of top and bottom scorers compared for the discrimination index.
+DISCRIMINATION_GROUP = 0.27
+# Response matrices kept in memory; least recently analyzed tests are evicted first.
+MAX_MATRICES = 16
+
+_lock = threading.Lock()
+_matrices = LRUCache(MAX_MATRICES)      # {test_id: _ResponseMatrix}
+
+
+# ========== ENCODING ==========
+def encode_responses(bank, presented, answers):
+    """Pack one attempt into (responses, correct_bits): a byte per bank
+    question and a big-endian bitset of the questions answered correctly."""
+    codes = bytearray(len(bank.questions))
+    bits = bytearray((len(bank.questions) + 7) // 8)
+    for i, q in enumerate(bank.questions):
+        qid = q['id']
+        if qid not in presented:
+            continue
+        codes[i] = UNANSWERED
+        chosen = answers.get(qid)
+        if chosen is None:
+            continue
+        chosen = chosen.strip()
+        for k, option in enumerate(q['options']):
+            if option == chosen:
+                codes[i] = min(FIRST_OPTION + k, 255)
+                break
+        if chosen.lower() == bank.answers[qid].strip().lower():
+            bits[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(codes), bytes(bits)
+
+
+# ========== ATTEMPT MATRIX ==========
+class _ResponseMatrix:
+    """Every attempt at one test as rows of a growable uint8 matrix. New
+    attempts are appended by rowid high-water mark, so each refresh reads
+    only the rows inserted since the last one."""
+
+    def __init__(self, test_id):
+        self.test_id = test_id
+        self.last_rowid = 0
+        self.count = 0
+        self.width = 0
+        self.responses = np.zeros((0, 0), dtype=np.uint8)
+        self.correct = np.zeros((0, 0), dtype=bool)
+        self.scores = np.zeros(0, dtype=np.int32)
+        self.lock = threading.Lock()
+        self._stats = None
+
+    def _grow(self, rows, width):
+        if rows > self.responses.shape[0] or width > self.width:
+            capacity = max(rows, 2 * self.responses.shape[0], 64)
+            width = max(width, self.width)
+            responses = np.zeros((capacity, width), dtype=np.uint8)
+            correct = np.zeros((capacity, width), dtype=bool)
+            scores = np.zeros(capacity, dtype=np.int32)
+            responses[:self.count, :self.width] = self.responses[:self.count]
+            correct[:self.count, :self.width] = self.correct[:self.count]
+            scores[:self.count] = self.scores[:self.count]
+            self.responses, self.correct, self.scores, self.width = responses, correct, scores, width
+            self._stats = None
+
+    def refresh(self, conn):
+        cur = conn.execute('''
+            SELECT rowid, score, responses, correct_bits FROM attempts
+            WHERE test_id = ? AND rowid > ? ORDER BY rowid
+        ''', (self.test_id, self.last_rowid))
+        while True:
+            rows = cur.fetchmany(1000)
+            if not rows:
+                break
+            width = max((len(r[2]) for r in rows if r[2]), default=0)
+            self._grow(self.count + len(rows), width)
+            for rowid, score, responses, bits in rows:
+                if responses:
+                    n = len(responses)
+                    self.responses[self.count, :n] = np.frombuffer(responses, dtype=np.uint8)
+                    self.correct[self.count, :n] = np.unpackbits(np.frombuffer(bits, dtype=np.uint8))[:n]
+                self.scores[self.count] = score or 0
+                self.count += 1
+                self.last_rowid = rowid
+            self._stats = None
+
+    def stats(self, n_options):
+        if self._stats is not None:
+            return self._stats
+
+        n = self.count
+        responses = self.responses[:n]
+        correct = self.correct[:n]
+        scores = self.scores[:n]
+        presented = responses != NOT_PRESENTED
+        shown = presented.sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            difficulty = np.where(shown > 0, correct.sum(axis=0) / shown, np.nan)
+
+            # Upper vs lower 27% of total scores
+            group = max(1, int(round(n * DISCRIMINATION_GROUP))) if n else 0
+            order = np.argsort(scores, kind='stable')
+            lower, upper = order[:group], order[n - group:]
+
+            def p_correct(rows):
+                seen = presented[rows].sum(axis=0)
+                return np.where(seen > 0, correct[rows].sum(axis=0) / seen, np.nan)
+
+            discrimination = p_correct(upper) - p_correct(lower) if group else np.full(self.width, np.nan)
+
+        # Distractor frequency: one bincount over (question, option) pairs
+        chosen = responses.astype(np.int64) - FIRST_OPTION
+        q_index = np.broadcast_to(np.arange(self.width), responses.shape)
+        mask = chosen >= 0
+        width = max(n_options, int(chosen.max()) + 1 if mask.any() else 0, 1)
+        flat = q_index[mask] * width + chosen[mask]
+        distractors = np.bincount(flat, minlength=self.width * width).reshape(self.width, width)
+        unanswered = (responses == UNANSWERED).sum(axis=0)
+
+        self._stats = {
+            'attempts': n,
+            'shown': shown,
+            'difficulty': difficulty,
+            'discrimination': discrimination,
+            'distractors': distractors,
+            'unanswered': unanswered,
+            'score_distribution': np.bincount(scores, minlength=1) if n else np.zeros(1, dtype=np.int64),
+            'mean_score': float(scores.mean()) if n else 0.0,
+        }
+        return self._stats
+
+
+def get_item_analysis(bank, max_score=0):
+    """Per-question difficulty, discrimination and distractor counts plus the
+    score distribution (0..max_score) for the test whose question bank is `bank`."""
+    with _lock:
+        matrix = _matrices.get(bank.test_id)
+        if matrix is None:
+            matrix = _ResponseMatrix(bank.test_id)
+            _matrices.put(bank.test_id, matrix)
+
+    n_options = max((len(q['options']) for q in bank.questions), default=0)
+    with matrix.lock:
+        matrix.refresh(snapshot.get_db(storage.for_test(bank.test_id)))
+        matrix._grow(matrix.count, len(bank.questions))
+        stats = matrix.stats(n_options)
+
+    items = []
+    for i, q in enumerate(bank.questions):
+        answer = bank.answers[q['id']].strip().lower()
+        items.append({
+            'id': q['id'],
+            'question': q['question'],
+            'shown': int(stats['shown'][i]),
+            'difficulty': _number(stats['difficulty'][i]),
+            'discrimination': _number(stats['discrimination'][i]),
+            'unanswered': int(stats['unanswered'][i]),
+            'options': [
+                {'text': option,
+                 'count': int(stats['distractors'][i][k]),
+                 'correct': option.strip().lower() == answer}
+                for k, option in enumerate(q['options'])
+            ],
+        })
+
+    return {
+        'attempts': stats['attempts'],
+        'mean_score': stats['mean_score'],
+        'score_distribution': [int(c) for c in stats['score_distribution']]
+                              + [0] * (max_score + 1 - len(stats['score_distribution'])),
+        'items': items,
+    }
+
+
+def invalidate():
+    _matrices.clear()
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+def _reset_after_fork():
+    global _lock, _matrices
+    _lock = threading.Lock()
+    _matrices = LRUCache(MAX_MATRICES)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, redirect, session, url_for, flash
+from flask import Flask, render_template, request, redirect, session, url_for, flash, Response, jsonify, current_app
+from flask.cli import with_appcontext
 import random
 from datetime import datetime 
 from models import (
@@ -8,24 +9,213 @@ from models import (
     get_test_by_id, get_exam_questions,
     get_question_by_id, update_question, delete_question,
     get_student_attempts, get_all_tests, get_questions_by_test,
-    get_test_attempt_counts, get_current_test_id,get_user_by_username  # ✅ add this here
+    get_test_attempt_counts, get_current_test_id,get_user_by_username,  # ✅ add this here
+    get_attempt, publish_test, update_password, get_faculty_dashboard,
+    autopublish_if_complete, required_question_count,
+    get_attempted_test_ids, count_questions_before, get_test_summaries,
+    get_test_categories, search_questions, get_categories,
+    get_score_rank, get_score_ranks, get_leaderboard
 )
 from datetime import timedelta, datetime
 import os
-import sqlite3
-
-app = Flask(__name__)
-app.secret_key = 'super_secret_key'
-app.permanent_session_lifetime = timedelta(minutes=30)
-
-if not os.path.exists('database.db'):
-    init_db()
+import sys
+import click
+import analytics
+import assets
+import autosave
+import bulk
+import database
+import export
+import metrics
+import papers
+import registry
+import scheduler
+import similarity
+import snapshot
+import storage
+import versions
+
+# Routes and CLI commands are declared at import time and attached to each
+# app built by create_app(), keeping their plain endpoint names.
+_routes = []
+_commands = []
+
+
+def route(rule, **options):
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def command(name):
+    def decorator(callback):
+        _commands.append(click.command(name)(with_appcontext(callback)))
+        return callback
+    return decorator
+
+
+# (DATABASE, SHARDS, SHARD_CATEGORIES) of the apps this process has built.
+_configured = None
+
+
+def create_app(config=None):
+    """Build the portal app; `config` overrides the defaults, e.g.
+    create_app({'DATABASE': ':memory:', 'INIT_DB': True}) for a throwaway copy.
+
+    One database per process: the connection pools, shards, caches and the
+    writer and scheduler threads are module state shared by every app, so
+    building an app for another DATABASE (or SHARDS) would silently re-point
+    the apps built before it. That raises RuntimeError; building another app
+    for the same database is fine. A ':memory:' database is new on every
+    call, so it can only be used once per process."""
+    global _configured
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY='super_secret_key',
+        PERMANENT_SESSION_LIFETIME=timedelta(minutes=30),
+        # SQLite file path, ':memory:', or a file: URI. Point it at tmpfs
+        # (e.g. /dev/shm/portal.db) for benchmarks.
+        DATABASE=os.environ.get('DATABASE', 'database.db'),
+        # Create or upgrade the schema on startup. Off by default: run
+        # `flask init-db` once per deploy instead.
+        INIT_DB=os.environ.get('INIT_DB') == '1',
+        # Set to True to add X-Response-Time / Server-Timing headers to every response.
+        METRICS_TIMING_HEADERS=os.environ.get('METRICS_TIMING_HEADERS') == '1',
+        # Optional bearer token so a Prometheus scraper can read /metrics without a session.
+        METRICS_TOKEN=os.environ.get('METRICS_TOKEN'),
+        # Set to run the test lifecycle scheduler inside this process instead of
+        # (or in addition to) `flask run-scheduler`; its jobs are idempotent.
+        RUN_SCHEDULER=os.environ.get('RUN_SCHEDULER') == '1',
+        # Optional storage shards {name: database path}, e.g.
+        # SHARDS=aptitude=shards/aptitude.db,verbal=shards/verbal.db. New tests
+        # of a category go to the shard of that name unless SHARD_CATEGORIES
+        # (e.g. communication=verbal) routes it elsewhere; see storage.py.
+        SHARDS=storage.parse_mapping(os.environ.get('SHARDS')),
+        SHARD_CATEGORIES=storage.parse_mapping(os.environ.get('SHARD_CATEGORIES')),
+        # Analytics (attempt counts, item analysis) read backup copies of the
+        # databases up to this many seconds old, so they never compete with
+        # exam submissions; 0 reads the live databases. Snapshots are kept in
+        # memory per process unless ANALYTICS_SNAPSHOT_DIR names a directory
+        # for snapshot files shared by all workers; see snapshot.py.
+        ANALYTICS_MAX_STALENESS=int(os.environ.get('ANALYTICS_MAX_STALENESS', snapshot.MAX_STALENESS)),
+        ANALYTICS_SNAPSHOT_DIR=os.environ.get('ANALYTICS_SNAPSHOT_DIR'),
+        # Estimated similarity (0-1) at which an uploaded question is flagged
+        # as a near-duplicate of one already in the bank; see similarity.py.
+        SIMILARITY_THRESHOLD=float(os.environ.get('SIMILARITY_THRESHOLD', similarity.THRESHOLD)),
+    )
+    app.config.update(config or {})
+
+    target = (app.config['DATABASE'], app.config['SHARDS'], app.config['SHARD_CATEGORIES'])
+    if _configured is not None and (target != _configured or target[0] == ':memory:'):
+        raise RuntimeError(f"This process already serves DATABASE={_configured[0]!r} "
+                           f"(shards {_configured[1] or 'none'}); cannot also serve {target[0]!r} "
+                           f"(shards {target[1] or 'none'}).")
+    _configured = target
+
+    database.init_app(app)
+    storage.init_app(app)
+    snapshot.init_app(app)
+    similarity.init_app(app)
+    metrics.init_app(app)
+    assets.init_app(app)
+    # Cached data belongs to whatever database was configured before.
+    registry.invalidate()
+    papers.invalidate()
+    analytics.invalidate()
+
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for cmd in _commands:
+        app.cli.add_command(cmd)
+
+    if app.config['INIT_DB']:
+        with app.app_context():
+            init_db()
+    if app.config['RUN_SCHEDULER']:
+        scheduler.start()
+    return app
+
+
+@command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema."""
+    try:
+        applied = database.migrate(verbose=True)
+    except database.MigrationError as e:
+        raise click.ClickException(str(e))
+    if not applied:
+        print(f"ℹ️ Schema already at version {database.schema_version(database.get_db())}.")
+    storage.migrate(verbose=True)
+
+
+@command('build-assets')
+def build_assets_command():
+    """Hash and precompress static/css and static/js into static/dist."""
+    manifest = assets.build(current_app.static_folder)
+    assets.load_manifest(current_app)
+    click.echo(f"✅ Built {len(manifest)} assets into {os.path.join(current_app.static_folder, assets.DIST_DIR)}"
+               + ("" if assets.brotli else " (gzip only: install brotli for .br files)"))
+
+
+@command('import-users')
+@click.argument('csv_file', type=click.File('rb'))
+@click.option('--chunk-size', default=bulk.CHUNK_SIZE, show_default=True, help="Rows per transaction.")
+@click.option('--errors', 'errors_file', type=click.File('w'), help="Write rejected rows to this CSV.")
+def import_users_command(csv_file, chunk_size, errors_file):
+    """Bulk-create users from a CSV with username,password,role columns."""
+    report = bulk.import_users(bulk.read_csv(csv_file), chunk_size=chunk_size)
+    print(f"✅ {report.inserted} users created, {len(report.errors)} rows rejected.")
+    if report.errors:
+        report.write_errors_csv(errors_file or sys.stdout)
+
+
+@command('import-questions')
+@click.argument('test_id', type=int)
+@click.argument('question_file', type=click.File('rb'))
+@click.option('--errors', 'errors_file', type=click.File('w'), help="Write rejected rows to this CSV.")
+def import_questions_command(test_id, question_file, errors_file):
+    """Bulk-add questions to a test from a CSV or JSON file."""
+    try:
+        report = bulk.import_questions(test_id, bulk.read_questions(question_file, question_file.name))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"✅ {report.inserted} questions added, {len(report.errors)} rows rejected.")
+    if report.published:
+        print("✅ All questions uploaded. Test automatically published.")
+    for warning in report.warnings:
+        print(f"⚠️ Line {warning['line']}: {warning['error']}")
+    if report.errors:
+        report.write_errors_csv(errors_file or sys.stdout)
+
+
+@command('run-scheduler')
+def run_scheduler_command():
+    """Open and close tests at their dates, grading abandoned drafts and
+    summarizing results when a test closes."""
+    print("⏰ Scheduler running, Ctrl+C to stop.")
+    scheduler.run_forever()
+
+
+@command('export-results')
+@click.argument('test_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='csv', show_default=True)
+@click.option('--responses', is_flag=True, help="Include each student's answer to every question.")
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help="File to write (default: stdout).")
+def export_results_command(test_id, fmt, responses, output):
+    """Stream every attempt at a test as CSV or NDJSON."""
+    test = get_test_by_id(test_id)
+    if not test:
+        raise click.ClickException("Test not found.")
+    bank = papers.get_paper(test_id) if responses else None
+    for chunk in export.stream(test_id, test[2], fmt, bank):
+        output.write(chunk)
 
-@app.route('/')
+@route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         role = request.form['role']
@@ -43,7 +233,7 @@ def register():
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username'].strip().lower()
@@ -68,7 +258,7 @@ def login():
 
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     if 'username' in session:
         session.clear()
@@ -78,54 +268,39 @@ def logout():
     return redirect(url_for('login'))
 
 
-@app.route('/student_dashboard')
+@route('/student_dashboard')
 def student_dashboard():
     if 'username' in session and session['role'] == 'student':
         username = session['username']
-        all_tests = get_all_tests()
-        attempts = get_student_attempts(username)
-        attempted_test_ids = {a[3] for a in attempts}  # a[3] is test_id in attempts
-
-        latest_tests = {}
-        for test in all_tests:
-            test_id, category, total_qs, start_date, end_date, duration, published = test[:7]
-
-            if published != 1:
-                continue  # Skip unpublished tests
-
-            # Keep only the latest published test for each category
-            if category not in latest_tests or test_id > latest_tests[category][0]:
-                latest_tests[category] = test
+        published = registry.get_published_tests().values()
+        attempted_test_ids = get_attempted_test_ids(username, [t.test_id for t in published])
 
         now = datetime.now()
         test_info = []
 
-        for test in latest_tests.values():
-            test_id, category, total_qs, start_date, end_date, duration, published = test[:7]
-
-            # Safely parse dates and validate they're in correct format
-            try:
-                start = datetime.strptime(start_date, "%Y-%m-%d")
-                end = datetime.strptime(end_date, "%Y-%m-%d")
-            except ValueError:
-                continue  # Skip malformed dates
+        # Latest published test per category, with dates already parsed
+        for test in published:
+            # Skip malformed dates
+            if test.start is None or test.end is None:
+                continue
 
             # Skip expired tests
-            if now > end:
+            if now > test.end:
                 continue
 
             # Determine time remaining message
-            if now < start:
-                remaining = f"Starts in {(start - now).days} day(s)"
+            if now < test.start:
+                remaining = f"Starts in {(test.start - now).days} day(s)"
             else:
-                remaining = f"{(end - now).days} day(s) left"
+                remaining = f"{(test.end - now).days} day(s) left"
 
             test_info.append({
-                'test_id': test_id,
-                'category': category,
-                'attempted': test_id in attempted_test_ids,
+                'test_id': test.test_id,
+                'category': test.category,
+                'attempted': test.test_id in attempted_test_ids,
                 'remaining_time': remaining,
-                'duration': duration
+                'open': test.is_open(now),
+                'duration': test.duration
             })
 
         return render_template('student_dashboard.html', test_info=test_info)
@@ -135,36 +310,38 @@ def student_dashboard():
 
 
 
-@app.route('/exam/<category>', methods=['GET', 'POST'])
+@route('/exam/<category>', methods=['GET', 'POST'])
 def exam(category):
     if 'username' not in session or session['role'] != 'student':
         flash("❌ Unauthorized access.")
         return redirect(url_for('login'))
 
     username = session['username']
-    test_id = get_current_test_id(category)
+    test = registry.get_published_test(category)
+    test_id = test.test_id if test else None
 
     if not test_id:
         flash("❌ Test not found or not published.")
         return redirect(url_for('student_dashboard'))
 
     # Check if already attempted
-    conn = sqlite3.connect('database.db')
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM attempts WHERE username = ? AND test_id = ?", (username, test_id))
-    attempt = cur.fetchone()
-    conn.close()
+    attempt = get_attempt(username, test_id)
 
     if attempt:
         return redirect(url_for('exam_result', category=category))
 
-    # Get questions
-    raw_questions = get_exam_questions(category)
-    if not raw_questions:
-        flash("❌ No questions available for this test.")
+    # New papers only while the test is open; answers already in progress
+    # are accepted until the timer of a last-minute start runs out.
+    if not (test.accepts_submissions() if request.method == 'POST' else test.is_open()):
+        flash("❌ This test is not open right now.")
         return redirect(url_for('student_dashboard'))
 
-    questions = [{'id': q['id'], 'question': q['question'], 'options': q['options']} for q in raw_questions]
+    # Get the compiled question paper (cached per published test, or drawn
+    # from the test's question pool for this student)
+    paper = papers.get_student_paper(test, username)
+    if not paper:
+        flash("❌ No questions available for this test.")
+        return redirect(url_for('student_dashboard'))
 
     if request.method == 'POST':
         answers = {}
@@ -175,104 +352,139 @@ def exam(category):
 
         try:
             score, total = record_attempt(username, category, answers)
-            percentage = round((score / total) * 100, 2) if total else 0
-            return render_template('exam_result.html', score=score, total=total, percentage=percentage)
+            return render_result(test_id, username, score, total)
         except Exception as e:
             flash(f"❌ Error submitting exam: {e}")
             return redirect(url_for('student_dashboard'))
 
     # Get test duration for timer (fallback: 30 mins)
-    test = next((t for t in get_all_tests() if t[0] == test_id), None)
-    duration = test[5] if test else 30
+    duration = test.duration or 30
 
-    return render_template('exam_page.html', questions=questions, category=category, duration=duration)
+    return render_template(
+        'exam_page.html',
+        questions_html=paper.render(),
+        category=category,
+        duration=duration,
+        saved_answers={str(qid): answer for qid, answer in autosave.load(username, test_id).items()}
+    )
 
 
+@route('/exam/<category>/autosave', methods=['POST'])
+def exam_autosave(category):
+    if 'username' not in session or session['role'] != 'student':
+        return jsonify(error="Unauthorized access."), 401
 
+    username = session['username']
+    test = registry.get_published_test(category)
+    if not test:
+        return jsonify(error="Test not found or not published."), 404
+    if get_attempt(username, test.test_id):
+        return jsonify(error="Exam already submitted."), 409
+    if not test.accepts_submissions():
+        return jsonify(error="This test is closed."), 409
 
+    paper = papers.get_student_paper(test, username)
+    payload = request.get_json(silent=True) or {}
+    delta = {}
+    for key, answer in (payload.get('answers') or {}).items():
+        qid = int(key) if str(key).isdigit() else None
+        if paper and qid in paper.answers and isinstance(answer, str):
+            delta[qid] = answer
 
+    # Buffered in memory and flushed to attempt_answers in periodic batches
+    autosave.save(username, test.test_id, delta)
+    return jsonify(saved=len(delta))
 
-@app.route('/result/<category>')
+
+
+
+
+
+@route('/result/<category>')
 def exam_result(category):
     if 'username' not in session or session['role'] != 'student':
         flash("❌ Unauthorized access.")
         return redirect(url_for('login'))
 
     username = session['username']
-    test_id = get_current_test_id(category)
+    test = registry.get_published_test(category)
+    test_id = test.test_id if test else None
 
     if not test_id:
         flash("❌ No published test found for this category.")
         return redirect(url_for('student_dashboard'))
 
-    conn = sqlite3.connect('database.db')
-    cur = conn.cursor()
+    # Refreshing a result costs one version lookup per database until the
+    # test or the student's attempts change, or the test's rankings do
+    # (checked once per versions.RANK_STALENESS seconds).
+    tag = versions.etag(test_id, versions.test_version(test_id), versions.user_version(username),
+                        versions.ranks_version(test_id))
+    cached = versions.not_modified(tag)
+    if cached:
+        return cached
 
     # Check for attempt
-    cur.execute("SELECT score FROM attempts WHERE username = ? AND test_id = ?", (username, test_id))
-    row = cur.fetchone()
+    row = get_attempt(username, test_id)
     if not row:
-        conn.close()
         flash("❌ You have not attempted this test.")
         return redirect(url_for('student_dashboard'))
 
-    score = row[0]
+    return versions.tagged(render_result(test_id, username, row[0], test.total_qs), tag)
 
-    # Fetch total questions for the test
-    cur.execute("SELECT total_qs FROM tests WHERE id = ?", (test_id,))
-    result = cur.fetchone()
-    conn.close()
 
-    if not result:
-        flash("⚠️ Test details not found.")
-        return redirect(url_for('student_dashboard'))
+def render_result(test_id, username, score, total):
+    percentage = round((score / total) * 100, 2) if total else 0
+    return render_template('exam_result.html', score=score, total=total, percentage=percentage,
+                           username=username, rank=get_score_rank(test_id, score),
+                           leaderboard=get_leaderboard(test_id))
 
-    total_qs = result[0]
-    percentage = round((score / total_qs) * 100, 2) if total_qs else 0
 
-    return render_template('exam_result.html', score=score, total=total_qs, percentage=percentage)
 
-
-
-@app.route('/faculty_dashboard')
+@route('/faculty_dashboard')
 def faculty_dashboard():
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
         return redirect(url_for('login'))
 
-    all_tests = get_all_tests()
     incomplete_tests = []
     complete_tests = []
     published_tests = []
     question_counts = {}
+    attempt_counts = {}
 
-    for test in all_tests:
+    required_counts = {}
+
+    rows, next_cursor = get_faculty_dashboard(request.args.get('limit'), request.args.get('cursor'))
+    for row in rows:
+        test = row[:9]
         test_id = test[0]
-        total_qs = test[2]
         is_published = test[6]
+        uploaded_qs, attempt_count = row[9], row[10]
 
-        uploaded_qs = get_question_count_for_test(test_id)
         question_counts[test_id] = uploaded_qs
+        attempt_counts[test_id] = attempt_count
+        required_counts[test_id] = required_question_count(test)
 
-        if uploaded_qs < total_qs:
+        if uploaded_qs < required_counts[test_id]:
             incomplete_tests.append(test)
         elif is_published == 0:
             complete_tests.append(test)
         else:
             published_tests.append(test)
 
-    analytics = get_test_attempt_counts()
-
     return render_template(
         'faculty_dashboard.html',
         tests=incomplete_tests,
         review_tests=complete_tests,
         live_tests=published_tests,
-        analytics=analytics,
-        question_counts=question_counts
+        question_counts=question_counts,
+        attempt_counts=attempt_counts,
+        required_counts=required_counts,
+        summaries=get_test_summaries([t[0] for t in published_tests]),
+        next_cursor=next_cursor
     )
 
-@app.route('/upload_question', methods=['POST'])
+@route('/upload_question', methods=['POST'])
 def upload_question():
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
@@ -285,20 +497,13 @@ def upload_question():
 
     try:
         # Add the question
-        add_question_to_test(test_id, question, options, answer)
+        similar = add_question_to_test(test_id, question, options, answer)
         flash("✅ Question uploaded successfully.")
+        for match in similar[:3]:
+            flash(f"⚠️ {match['similarity']:.0%} similar to a question of test {match['test_id']}: {match['question']}")
 
-        # Check progress
-        uploaded = get_question_count_for_test(test_id)
-        total = get_test_by_id(test_id)[2]
-
-        if uploaded >= total:
-            # Auto-publish test
-            conn = sqlite3.connect('database.db')
-            cur = conn.cursor()
-            cur.execute("UPDATE tests SET published = 1 WHERE id = ?", (test_id,))
-            conn.commit()
-            conn.close()
+        # Check progress and auto-publish once every question is in
+        if autopublish_if_complete(test_id):
             flash("✅ All questions uploaded. Test automatically published.")
             return redirect(url_for('faculty_dashboard'))
 
@@ -310,7 +515,30 @@ def upload_question():
 
 
 
-@app.route('/create_test', methods=['POST'])
+@route('/review_test/<int:test_id>/import', methods=['POST'])
+def import_questions(test_id):
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    upload = request.files.get('question_file')
+    if not upload or not upload.filename:
+        flash("❌ Please choose a CSV or JSON file to upload.")
+        return redirect(url_for('review_test', test_id=test_id))
+
+    try:
+        report = bulk.import_questions(test_id, bulk.read_questions(upload.stream, upload.filename))
+    except (UnicodeDecodeError, ValueError) as e:
+        flash(f"❌ {e}")
+        return redirect(url_for('review_test', test_id=test_id))
+
+    if report.published:
+        flash("✅ All questions uploaded. Test automatically published.")
+    return render_template('import_report.html', report=report, title="Question Import",
+                           item_label="Question", back_url=url_for('review_test', test_id=test_id))
+
+
+@route('/create_test', methods=['POST'])
 def create_test_view():
     # Check for faculty authentication first
     if 'username' not in session or session['role'] != 'faculty':
@@ -324,8 +552,9 @@ def create_test_view():
         start_date = request.form['start_date']
         end_date = request.form['end_date']
         created_by = session['username']
+        pool_size = int(request.form['pool_size']) if request.form.get('pool_size') else None
 
-        test_id = create_test(category, total_qs, duration, start_date, end_date, created_by)
+        test_id = create_test(category, total_qs, duration, start_date, end_date, created_by, pool_size)
 
         if test_id:
             flash("✅ Test created successfully. Please upload questions now.")
@@ -341,7 +570,27 @@ def create_test_view():
 
 
 
-@app.route('/change_password', methods=['GET', 'POST'])
+@route('/import_users', methods=['POST'])
+def import_users():
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    upload = request.files.get('roster')
+    if not upload or not upload.filename:
+        flash("❌ Please choose a CSV file to upload.")
+        return redirect(url_for('faculty_dashboard'))
+
+    try:
+        report = bulk.import_users(bulk.read_csv(upload.stream))
+    except (UnicodeDecodeError, ValueError) as e:
+        flash(f"❌ Could not read the CSV file: {e}")
+        return redirect(url_for('faculty_dashboard'))
+
+    return render_template('import_report.html', report=report, title="User Import", item_label="Username")
+
+
+@route('/change_password', methods=['GET', 'POST'])
 def change_password():
     if 'username' not in session:
         flash("❌ Unauthorized access.")
@@ -369,13 +618,7 @@ def change_password():
             return redirect(url_for('change_password'))
 
         try:
-            with sqlite3.connect('database.db') as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    "UPDATE users SET password = ? WHERE username = ? AND role = ?",
-                    (new_password, username, role)
-                )
-                conn.commit()
+            update_password(username, role, new_password)
             flash("✅ Password changed successfully.")
             return redirect(url_for('student_dashboard' if role == 'student' else 'faculty_dashboard'))
         except Exception as e:
@@ -384,31 +627,42 @@ def change_password():
 
     return render_template('change_password.html')
 
-@app.route('/review_test/<int:test_id>')
+@route('/review_test/<int:test_id>')
 def review_test(test_id):
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
         return redirect(url_for('login'))
 
+    tag = versions.etag(versions.test_version(test_id))
+    cached = versions.not_modified(tag)
+    if cached:
+        return cached
+
     test = get_test_by_id(test_id)
     if not test:
         flash("❌ Test not found.")
         return redirect(url_for('faculty_dashboard'))
 
-    test_id, category, total_qs, start_date, end_date, duration, published, created_by = test
-    questions = get_questions_by_test(test_id)
+    test_id, category, total_qs, start_date, end_date, duration, published, created_by, pool_size = test
+    cursor = request.args.get('cursor')
+    questions, next_cursor = get_questions_by_test(test_id, request.args.get('limit', 50), cursor)
+    first_number = count_questions_before(test_id, questions[0][0]) + 1 if cursor and questions else 1
 
-    return render_template(
+    return versions.tagged(render_template(
         'review_test.html',
         questions=questions,
+        uploaded=get_question_count_for_test(test_id),
+        first_number=first_number,
+        next_cursor=next_cursor,
         test_id=test_id,
         total_qs=total_qs,
+        pool_size=pool_size,
         category=category,
         published=published
-    )
+    ), tag)
 
 
-@app.route('/edit_question/<int:qid>', methods=['GET', 'POST'])
+@route('/edit_question/<int:qid>', methods=['GET', 'POST'])
 def edit_question(qid):
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
@@ -433,7 +687,11 @@ def edit_question(qid):
         new_options = request.form.getlist('options')
         new_answer = request.form['answer']
 
-        update_question(qid, new_question, new_options, new_answer)
+        try:
+            update_question(qid, new_question, new_options, new_answer)
+        except ValueError as e:
+            flash(f"❌ {e}")
+            return redirect(url_for('review_test', test_id=test_id))
         flash("✅ Question updated successfully.")
         return redirect(url_for('review_test', test_id=test_id))
 
@@ -443,13 +701,13 @@ def edit_question(qid):
     question=question_text,
     options=options,
     answer=correct_answer,
-    total_qs=get_test_by_id(test_id)[2],
-    questions=get_questions_by_test(test_id),
+    total_qs=required_question_count(test),
+    uploaded=get_question_count_for_test(test_id),
     can_edit=(test[6] == 0)  # Only allow editing if test is not published
 )
 
 
-@app.route('/delete_question/<int:qid>')
+@route('/delete_question/<int:qid>')
 def delete_question_route(qid):
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
@@ -473,7 +731,7 @@ def delete_question_route(qid):
     return redirect(url_for('review_test', test_id=test_id))
 
 
-@app.route('/confirm_publish/<int:test_id>', methods=['POST'])
+@route('/confirm_publish/<int:test_id>', methods=['POST'])
 def confirm_test_publish(test_id):
     if 'username' not in session or session['role'] != 'faculty':
         flash("❌ Unauthorized access.")
@@ -485,46 +743,158 @@ def confirm_test_publish(test_id):
         return redirect(url_for('faculty_dashboard'))
 
     question_count = get_question_count_for_test(test_id)
-    required_questions = test[2]  # total_qs
+    required_questions = required_question_count(test)  # total_qs, or the pool size
 
     if question_count == required_questions:
-        conn = sqlite3.connect('database.db')
-        cur = conn.cursor()
-        cur.execute("UPDATE tests SET published = 1 WHERE id = ?", (test_id,))
-        conn.commit()
-        conn.close()
+        publish_test(test_id)
         flash("✅ Test published successfully.")
     else:
         flash(f"❌ Cannot publish. {required_questions - question_count} more questions needed.")
 
     return redirect(url_for('faculty_dashboard'))
 
-@app.route("/stats")
+@route('/analytics/<int:test_id>')
+def item_analysis(test_id):
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    test = get_test_by_id(test_id)
+    paper = papers.get_paper(test_id) if test else None
+    if not paper:
+        flash("❌ Test not found or has no questions.")
+        return redirect(url_for('faculty_dashboard'))
+
+    report = analytics.get_item_analysis(paper, max_score=test[2])
+    return render_template('item_analysis.html', test=test, report=report)
+
+@route('/review_test/<int:test_id>/similar')
+def similar_questions(test_id):
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    test = get_test_by_id(test_id)
+    if not test:
+        flash("❌ Test not found.")
+        return redirect(url_for('faculty_dashboard'))
+
+    try:
+        threshold = min(max(float(request.args.get('threshold', similarity.THRESHOLD)), 0.3), 1.0)
+    except ValueError:
+        threshold = similarity.THRESHOLD
+
+    flagged = []
+    for qid, question, sig in similarity.signatures_for_test(test_id):
+        matches = similarity.find_similar(sig=sig, threshold=threshold, exclude={qid})
+        if matches:
+            flagged.append({'id': qid, 'question': question, 'matches': matches})
+    categories = get_test_categories({m['test_id'] for q in flagged for m in q['matches']})
+
+    return render_template('similar_questions.html', test=test, flagged=flagged,
+                           categories=categories, threshold=threshold)
+
+
+@route('/search')
+def search_questions_view():
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    text = request.args.get('q', '').strip()
+    category = request.args.get('category') or None
+    test_id = request.args.get('test_id', type=int)
+    questions, next_cursor = search_questions(text, category, test_id,
+                                              request.args.get('limit'), request.args.get('cursor'))
+    categories = get_test_categories({q[1] for q in questions})
+
+    return render_template('search.html', text=text, category=category, test_id=test_id,
+                           questions=questions, next_cursor=next_cursor, categories=categories,
+                           all_categories=get_categories(), first_page=not request.args.get('cursor'))
+
+
+@route('/export/<int:test_id>')
+def export_results(test_id):
+    if 'username' not in session or session['role'] != 'faculty':
+        flash("❌ Unauthorized access.")
+        return redirect(url_for('login'))
+
+    test = get_test_by_id(test_id)
+    if not test:
+        flash("❌ Test not found.")
+        return redirect(url_for('faculty_dashboard'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        fmt = 'csv'
+    bank = papers.get_paper(test_id) if request.args.get('responses') == '1' else None
+
+    filename = f"{test[1]}-test{test_id}-results.{fmt}"
+    return Response(export.stream(test_id, test[2], fmt, bank), content_type=export.CONTENT_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+@route("/stats")
 def stats():
     if "username" not in session:
         return redirect(url_for("login"))
 
     username = session["username"]
-    attempts = get_student_attempts(username)
+    tag = versions.etag(versions.user_version(username), versions.ranks_version())
+    cached = versions.not_modified(tag)
+    if cached:
+        return cached
+
+    attempts, next_cursor = get_student_attempts(username, request.args.get('limit'), request.args.get('cursor'))
+    ranks = get_score_ranks((a[3], a[2]) for a in attempts if a[3] is not None)
 
-    return render_template("stats.html", attempts=attempts)
+    return versions.tagged(render_template("stats.html", attempts=attempts, ranks=ranks, next_cursor=next_cursor,
+                                           first_page=not request.args.get('cursor')), tag)
 
 from models import get_user_by_username
 
-@app.route("/profile")
+@route("/profile")
 def profile():
     if "username" not in session:
         return redirect(url_for("login"))
 
+    tag = versions.etag(versions.user_version(session["username"]))
+    cached = versions.not_modified(tag)
+    if cached:
+        return cached
+
     student = get_user_by_username(session["username"])
     if not student:
         return "User not found", 404
 
-    return render_template("profile.html", student=student)
+    return versions.tagged(render_template("profile.html", student=student), tag)
+
+
+@route("/metrics")
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    authorized = session.get('role') in ('faculty', 'admin') or (
+        token and request.headers.get('Authorization') == f"Bearer {token}"
+    )
+    if not authorized:
+        return "Forbidden", 403
+
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def __getattr__(name):
+    # `flask --app app` and WSGI servers look up `app`: build it on first
+    # use, not on import, so importing create_app has no side effects.
+    global app
+    if name == 'app':
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == '__main__':
-    init_db()
+    app = create_app({'INIT_DB': True})
     app.run(debug=True)
 
 
@@ -0,0 +1,122 @@
+"""Static asset pipeline.
+
+`flask build-assets` copies every file under static/css and static/js to
+static/dist under a content-hashed name (style.css -> style.3f2a9c1e7b04.css)
+next to precompressed .gz (and, with the brotli package installed, .br)
+variants, and writes static/dist/manifest.json. Templates link assets with
+asset_url('css/base.css'), which resolves through the manifest, so a hashed
+URL never changes content and is served with an immutable year-long
+Cache-Control. Without a build asset_url() falls back to the plain static file.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:     # optional: gzip only
+    brotli = None
+
+SOURCE_DIRS = ('css', 'js')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+# Compressing tiny files costs more in headers than it saves.
+MIN_COMPRESS_SIZE = 256
+MAX_AGE = 365 * 24 * 3600
+# Preferred first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# ========== BUILD ==========
+def build(static_folder):
+    """Hash and compress every source asset; returns the new manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        root = os.path.join(static_folder, source_dir)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                manifest[name] = _write_hashed(dist, name, data)
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _write_hashed(dist, name, data):
+    stem, ext = os.path.splitext(name)
+    hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+    path = os.path.join(dist, hashed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    if len(data) >= MIN_COMPRESS_SIZE:
+        # mtime=0 keeps the .gz byte-identical across builds.
+        _write_if_smaller(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0), data)
+        if brotli is not None:
+            _write_if_smaller(path + '.br', brotli.compress(data, quality=11), data)
+    return hashed
+
+
+def _write_if_smaller(path, compressed, data):
+    if len(compressed) < len(data):
+        with open(path, 'wb') as f:
+            f.write(compressed)
+
+
+# ========== SERVING ==========
+def load_manifest(app):
+    path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+    try:
+        with open(path) as f:
+            app.extensions['assets'] = json.load(f)
+    except FileNotFoundError:
+        app.extensions['assets'] = {}
+
+
+def asset_url(filename):
+    """url_for('static', filename=...) for built assets: the hashed,
+    cacheable URL when the asset is in the manifest, else the plain one."""
+    hashed = current_app.extensions.get('assets', {}).get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=hashed)
+
+
+def serve_asset(filename):
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = request.accept_encodings
+
+    for encoding, suffix in ENCODINGS:
+        if accepted[encoding] and os.path.isfile(os.path.join(dist, filename + suffix)):
+            response = send_from_directory(dist, filename + suffix, mimetype=mimetype, max_age=MAX_AGE)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(dist, filename, mimetype=mimetype, max_age=MAX_AGE)
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    load_manifest(app)
+    app.add_url_rule(f'{app.static_url_path}/{DIST_DIR}/<path:filename>', 'asset', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
@@ -0,0 +1,127 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import metrics
+import storage
+
+# Seconds between flushes of buffered answers to attempt_answers.
+FLUSH_INTERVAL = 2.0
+
+_lock = threading.Lock()
+_pending = {}           # {(username, test_id): {qid: answer}}
+_flusher = None
+_flusher_pid = None
+_flushes = 0
+
+metrics.Callback('portal_autosave_pending_drafts', "Exam drafts with answers not yet flushed.",
+                 lambda: len(_pending))
+metrics.Callback('portal_autosave_flushes_total', "Batched autosave flushes committed.",
+                 lambda: _flushes, type='counter')
+
+
+def save(username, test_id, delta):
+    """Buffer an answer delta ({qid: answer}); it is persisted on the next flush."""
+    _ensure_flusher()
+    with _lock:
+        _pending.setdefault((username, test_id), {}).update(delta)
+
+
+def load(username, test_id):
+    """Everything answered so far: the persisted draft plus unflushed deltas."""
+    row = storage.for_test(test_id).get_db().execute(
+        "SELECT answers FROM attempt_answers WHERE username = ? AND test_id = ?",
+        (username, test_id)
+    ).fetchone()
+    answers = {int(qid): answer for qid, answer in json.loads(row[0]).items()} if row else {}
+    with _lock:
+        answers.update(_pending.get((username, test_id), {}))
+    return answers
+
+
+def discard(username, test_id):
+    """Drop unflushed deltas once the attempt has been committed."""
+    with _lock:
+        _pending.pop((username, test_id), None)
+
+
+def delete_draft(conn, username, test_id):
+    # Runs inside the writer job that records the final attempt.
+    conn.execute("DELETE FROM attempt_answers WHERE username = ? AND test_id = ?", (username, test_id))
+
+
+def flush():
+    """Write every buffered delta, one group commit per shard. Drafts are
+    merged with json_patch so deltas flushed by other worker processes are
+    kept, and skipped once the attempt has been submitted."""
+    global _pending, _flushes
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    by_shard = {}
+    for (username, test_id), delta in batch.items():
+        by_shard.setdefault(storage.for_test(test_id), []).append(
+            (username, test_id, json.dumps({str(qid): answer for qid, answer in delta.items()},
+                                           separators=(',', ':')), username, test_id)
+        )
+    try:
+        for shard, rows in by_shard.items():
+            shard.write(lambda conn, rows=rows: conn.executemany('''
+                INSERT INTO attempt_answers (username, test_id, answers, updated_at)
+                SELECT ?, ?, ?, datetime('now')
+                WHERE NOT EXISTS (SELECT 1 FROM attempts WHERE username = ? AND test_id = ?)
+                ON CONFLICT (username, test_id) DO UPDATE
+                SET answers = json_patch(answers, excluded.answers), updated_at = excluded.updated_at
+            ''', rows))
+            for username, test_id, *_ in rows:
+                batch.pop((username, test_id))
+    except Exception:
+        # Put the unwritten deltas back (under anything newer) so the next flush retries them.
+        with _lock:
+            for key, delta in batch.items():
+                delta.update(_pending.get(key, {}))
+                _pending[key] = delta
+        raise
+    _flushes += 1
+    return sum(len(rows) for rows in by_shard.values())
+
+
+def _run():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"⚠️ Autosave flush failed: {e}")
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    if _flusher is None or _flusher_pid != os.getpid():
+        with _lock:
+            if _flusher is None or _flusher_pid != os.getpid():
+                _flusher = threading.Thread(target=_run, name='autosave-flusher', daemon=True)
+                _flusher.start()
+                _flusher_pid = os.getpid()
+
+
+@atexit.register
+def _shutdown():
+    if _pending and _flusher_pid == os.getpid():
+        flush()
+
+
+def _reset_after_fork():
+    # Deltas buffered by the parent are the parent's to flush.
+    global _lock, _pending, _flusher
+    _lock = threading.Lock()
+    _pending = {}
+    _flusher = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
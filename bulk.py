@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import papers
+import similarity
+import storage
+import writer
+from database import get_db
+from models import autopublish_if_complete, clean_question, get_test_by_id, required_question_count
+
+# Rows written per transaction.
+CHUNK_SIZE = 5000
+VALID_ROLES = ('student', 'faculty')
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []        # [{'line': ..., 'key': ..., 'error': ...}]
+        self.warnings = []      # same shape; rows imported but worth a look
+        self.published = False
+
+    def error(self, line, key, message):
+        self.errors.append({'line': line, 'key': key, 'error': message})
+
+    def warn(self, line, key, message):
+        self.warnings.append({'line': line, 'key': key, 'error': message})
+
+    def write_errors_csv(self, fp):
+        out = csv.DictWriter(fp, fieldnames=['line', 'key', 'error'])
+        out.writeheader()
+        out.writerows(self.errors)
+
+
+def read_csv(stream):
+    """Yield (line number, row dict) from a binary or text CSV stream."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {(k or '').strip().lower(): (v or '') for k, v in row.items()}
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ========== USERS ==========
+def _existing_usernames(usernames):
+    cur = get_db().execute(
+        "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))",
+        (json.dumps(usernames),)
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def import_users(rows, chunk_size=CHUNK_SIZE):
+    """Validate, dedupe and insert users from (line, {'username', 'password',
+    'role'}) pairs, `chunk_size` rows per transaction."""
+    report = ImportReport()
+    seen = set()
+
+    def valid_rows():
+        for line, row in rows:
+            username = row.get('username', '').strip().lower()
+            password = row.get('password', '').strip()
+            role = row.get('role', '').strip().lower()
+
+            if not username or not password or not role:
+                report.error(line, username, "username, password and role are required.")
+            elif role not in VALID_ROLES:
+                report.error(line, username, f"Unknown role '{role}'.")
+            elif username in seen:
+                report.error(line, username, "Duplicate username in file.")
+            else:
+                seen.add(username)
+                yield line, username, password, role
+
+    for chunk in _chunks(valid_rows(), chunk_size):
+        existing = _existing_usernames([username for _, username, _, _ in chunk])
+        fresh = []
+        for line, username, password, role in chunk:
+            if username in existing:
+                report.error(line, username, "User already exists.")
+            else:
+                fresh.append((username, password, role))
+
+        if fresh:
+            writer.write(lambda conn, fresh=fresh: conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)", fresh
+            ))
+            report.inserted += len(fresh)
+
+    return report
+
+
+# ========== QUESTIONS ==========
+def read_questions(stream, filename=''):
+    """Yield (line or index, row dict) from a CSV or JSON question file.
+
+    CSV needs question and answer columns plus either an options column
+    ('|'-separated) or option1, option2, ... columns. JSON is a list of
+    objects with question, options (list or '|'-separated) and answer."""
+    if filename.lower().endswith('.json'):
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        items = json.load(stream)
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON list of questions.")
+        for index, item in enumerate(items, start=1):
+            yield index, item if isinstance(item, dict) else {}
+    else:
+        yield from read_csv(stream)
+
+
+def _row_options(row):
+    options = row.get('options')
+    if isinstance(options, list):
+        return [str(opt) for opt in options]
+    if options:
+        return str(options).split('|')
+    numbered = sorted((k for k in row if k.startswith('option') and k[6:].isdigit()), key=lambda k: int(k[6:]))
+    return [row[k] for k in numbered]
+
+
+def import_questions(test_id, rows):
+    """Validate and insert a batch of questions into one test in a single
+    transaction, then run the auto-publish check once. Near-duplicates of
+    questions in the bank or earlier in the file are imported with a warning.
+    A file with more valid questions than the test still needs is rejected
+    as a whole, so a test never ends up with more than it asked for."""
+    report = ImportReport()
+    test = get_test_by_id(test_id)
+    if not test:
+        raise ValueError("Test not found.")
+    if test[6] == 1:
+        raise ValueError("Test is already published. You cannot add questions.")
+
+    shard = storage.for_test(test_id)
+    cur = shard.get_db().execute("SELECT question FROM questions WHERE test_id = ?", (test_id,))
+    existing = {row[0] for row in cur.fetchall()}
+    remaining = max(required_question_count(test) - len(existing), 0)
+    upload_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    in_file_index = similarity.BatchIndex()
+    batch = []
+
+    for line, row in rows:
+        question = str(row.get('question') or '')
+        try:
+            question, options, answer = clean_question(question, _row_options(row), str(row.get('answer') or ''))
+        except ValueError as e:
+            report.error(line, question, str(e))
+            continue
+        if question in existing:
+            report.error(line, question, "Duplicate question found in the same test.")
+            continue
+        existing.add(question)
+
+        sig = similarity.signature(question)
+        similar = similarity.find_similar(sig=sig, limit=1)
+        if similar:
+            report.warn(line, question, f"{similar[0]['similarity']:.0%} similar to question "
+                                        f"{similar[0]['id']} of test {similar[0]['test_id']}: {similar[0]['question']}")
+        else:
+            in_file = in_file_index.find(sig)
+            if in_file:
+                report.warn(line, question, f"{in_file[0][0]:.0%} similar to line {in_file[0][1]} of this file.")
+        in_file_index.add(line, sig)
+        batch.append((line, (test_id, question, '|'.join(options), answer, upload_time), sig))
+
+    if len(batch) > remaining:
+        # Same limit as single uploads and publishing: required_question_count.
+        line, row, _ = batch[remaining]
+        report.error(line, row[1], f"The test needs {remaining} more question(s) but the file has "
+                                   f"{len(batch)} valid ones. Nothing was imported.")
+        report.warnings = []
+        return report
+
+    def insert(conn):
+        for _, row, sig in batch:
+            cur = conn.execute('''
+                INSERT INTO questions (test_id, question, options, answer, upload_time)
+                VALUES (?, ?, ?, ?, ?)
+            ''', row)
+            similarity.index_question(conn, cur.lastrowid, row[1], sig)
+
+    if batch:
+        shard.write(insert)
+        papers.invalidate(test_id)
+        report.inserted = len(batch)
+
+    report.published = autopublish_if_complete(test_id)
+    return report
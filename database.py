@@ -0,0 +1,449 @@
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+
+from flask import g, has_app_context
+
+import metrics
+
+# A file path (e.g. on tmpfs: /dev/shm/portal.db), ':memory:', or a
+# file: URI. Set through the app's DATABASE config, see configure().
+DATABASE = 'database.db'
+
+# Max idle connections kept around between requests.
+POOL_SIZE = 16
+
+# Applied once per connection, right after it is opened.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache
+    "PRAGMA mmap_size=67108864",     # 64 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+_target = (DATABASE, False)    # (filename or URI, is URI) passed to sqlite3.connect
+_anchor = None                 # keeps an in-memory database alive
+_memory_ids = itertools.count(1)
+# Bumped by configure(); long-lived connections compare it to notice the switch.
+generation = 0
+
+
+# ========== CONNECTIONS ==========
+def resolve(database):
+    """The (filename or URI, is URI) pair sqlite3.connect needs for a
+    DATABASE setting. ':memory:' becomes a named in-memory database (SQLite's
+    memdb VFS) that every connection of this process can open."""
+    if database == ':memory:':
+        return f"file:/portal-{os.getpid()}-{next(_memory_ids)}?vfs=memdb", True
+    return database, database.startswith('file:')
+
+
+def connect(target=None):
+    """Open a new tuned connection. Prefer get_db() unless you need a private one."""
+    target, uri = target or _target
+    conn = sqlite3.connect(target, timeout=5, check_same_thread=False, uri=uri,
+                           factory=metrics.InstrumentedConnection)
+    metrics.CONNECTIONS_OPENED.inc()
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _acquire():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return connect()
+
+
+def _release(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def get_db():
+    """Return the connection bound to the current request, or to the current
+    thread when called outside of Flask (CLI, background workers)."""
+    if has_app_context():
+        if 'db' not in g:
+            g.db = _acquire()
+        return g.db
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'generation', None) != generation:
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = _local.conn = connect()
+        _local.generation = generation
+    return conn
+
+
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        _release(conn)
+
+
+def close_thread_db():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+
+def configure_pool(size):
+    """Keep up to `size` idle connections, e.g. one per server thread."""
+    global POOL_SIZE, _pool
+    reset_pool()
+    POOL_SIZE = size
+    _pool = queue.LifoQueue(maxsize=size)
+
+
+def reset_pool():
+    """Drop every idle pooled connection."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+    close_thread_db()
+
+
+def configure(database):
+    """Point every new connection at `database`. An in-memory database lives
+    until the next configure() call."""
+    global DATABASE, _target, _anchor, generation
+    reset_pool()
+    if _anchor is not None:
+        _anchor.close()
+        _anchor = None
+
+    DATABASE = database
+    _target = resolve(database)
+    generation += 1
+    if database == ':memory:':
+        _anchor = connect()
+
+
+def init_app(app):
+    configure(app.config['DATABASE'])
+    app.teardown_appcontext(close_db)
+
+
+# ========== MIGRATIONS ==========
+# Each migration runs once, in order, inside its own transaction. The schema
+# version is tracked in PRAGMA user_version so an existing database.db is
+# upgraded in place. Never edit a released migration; append a new one.
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _m001_base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        username TEXT NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS tests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category TEXT NOT NULL,
+        total_qs INTEGER NOT NULL,
+        start_date TEXT,
+        end_date TEXT,
+        duration INTEGER,
+        published INTEGER DEFAULT 0,
+        created_by TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        test_id INTEGER,
+        question TEXT,
+        options TEXT,
+        answer TEXT,
+        upload_time TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS attempts (
+        username TEXT NOT NULL,
+        category TEXT NOT NULL,
+        test_id INTEGER,
+        score INTEGER NOT NULL,
+        timestamp TEXT NOT NULL
+    )''')
+
+    # Older databases predate these attempts columns.
+    existing = _columns(conn, 'attempts')
+    if 'score' not in existing:
+        conn.execute("ALTER TABLE attempts ADD COLUMN score INTEGER")
+    if 'test_id' not in existing:
+        conn.execute("ALTER TABLE attempts ADD COLUMN test_id INTEGER")
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied to this database as it stands."""
+
+
+# (what, query listing the duplicated keys) checked before the unique indexes.
+_DUPLICATE_CHECKS = (
+    ("usernames", "SELECT username, COUNT(*) FROM users GROUP BY username HAVING COUNT(*) > 1"),
+    ("questions (test, text)",
+     "SELECT test_id || ': ' || question, COUNT(*) FROM questions GROUP BY test_id, question HAVING COUNT(*) > 1"),
+    ("attempts (user, test)",
+     "SELECT username || ' @ test ' || test_id, COUNT(*) FROM attempts WHERE test_id IS NOT NULL "
+     "GROUP BY username, test_id HAVING COUNT(*) > 1"),
+)
+
+
+def _m002_indexes_and_constraints(conn):
+    # Older code let duplicates through. Which row to keep (a user's
+    # password, a student's result) is not ours to guess, so refuse instead.
+    problems = []
+    for what, query in _DUPLICATE_CHECKS:
+        rows = conn.execute(query).fetchall()
+        if rows:
+            examples = ', '.join(f"{key!r} x{count}" for key, count in rows[:5])
+            problems.append(f"{len(rows)} duplicated {what}, e.g. {examples}")
+    if problems:
+        raise MigrationError(
+            "Cannot add unique constraints; nothing was changed. Remove the duplicates, "
+            "keeping one row each, then run init-db again: " + '; '.join(problems) + '.'
+        )
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_users_username ON users (username)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_questions_test_question ON questions (test_id, question)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_attempts_user_test ON attempts (username, test_id)")
+
+    # Covering indexes for the hot lookups.
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_tests_category_published ON tests (category, published, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_questions_test ON questions (test_id, id, answer)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attempts_user ON attempts (username, timestamp, category, score, test_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attempts_test_score ON attempts (test_id, score)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attempts_category ON attempts (category)")
+
+
+def _m003_question_pools(conn):
+    # NULL means every student gets all total_qs questions in upload order;
+    # otherwise the bank holds pool_size questions and each student draws total_qs.
+    if 'pool_size' not in _columns(conn, 'tests'):
+        conn.execute("ALTER TABLE tests ADD COLUMN pool_size INTEGER")
+
+
+def _m004_answer_drafts(conn):
+    # Autosaved answers of in-progress attempts, as a compact JSON object
+    # {question_id: chosen option}; removed when the attempt is submitted.
+    conn.execute('''CREATE TABLE IF NOT EXISTS attempt_answers (
+        username TEXT NOT NULL,
+        test_id INTEGER NOT NULL,
+        answers TEXT NOT NULL DEFAULT '{}',
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (username, test_id)
+    ) WITHOUT ROWID''')
+
+
+def _m005_attempt_responses(conn):
+    # Per-question responses in question-bank order, see analytics.encode_responses.
+    existing = _columns(conn, 'attempts')
+    if 'responses' not in existing:
+        conn.execute("ALTER TABLE attempts ADD COLUMN responses BLOB")
+    if 'correct_bits' not in existing:
+        conn.execute("ALTER TABLE attempts ADD COLUMN correct_bits BLOB")
+
+
+def _m006_test_lifecycle(conn):
+    # Set by the scheduler once a test has closed and its drafts were finalized.
+    if 'closed_at' not in _columns(conn, 'tests'):
+        conn.execute("ALTER TABLE tests ADD COLUMN closed_at TEXT")
+    conn.execute('''CREATE TABLE IF NOT EXISTS test_summaries (
+        test_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        mean_score REAL,
+        min_score INTEGER,
+        max_score INTEGER,
+        score_histogram TEXT NOT NULL,
+        computed_at TEXT NOT NULL
+    )''')
+
+
+def _m007_storage_shards(conn):
+    # Shard holding a test's questions, attempts and drafts (NULL: this
+    # database), and the stable number of each shard; see storage.py.
+    if 'shard' not in _columns(conn, 'tests'):
+        conn.execute("ALTER TABLE tests ADD COLUMN shard TEXT")
+    conn.execute('''CREATE TABLE IF NOT EXISTS shards (
+        name TEXT PRIMARY KEY,
+        number INTEGER UNIQUE NOT NULL
+    )''')
+
+
+def _m008_data_versions(conn):
+    # Counters bumped by triggers whenever data behind a page changes, so
+    # conditional GETs can be answered without querying it; see versions.py.
+    # In a shard only the questions and attempts triggers ever fire.
+    conn.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (scope, key)
+    ) WITHOUT ROWID''')
+
+    def bump(scope, key):
+        return f'''INSERT INTO data_versions (scope, key, version) VALUES ('{scope}', IFNULL({key}, ''), 1)
+            ON CONFLICT (scope, key) DO UPDATE SET version = version + 1;'''
+
+    triggers = {
+        'trg_questions_insert_version': ('AFTER INSERT ON questions', [bump('test', 'NEW.test_id')]),
+        'trg_questions_update_version': ('AFTER UPDATE ON questions', [bump('test', 'OLD.test_id'), bump('test', 'NEW.test_id')]),
+        'trg_questions_delete_version': ('AFTER DELETE ON questions', [bump('test', 'OLD.test_id')]),
+        'trg_tests_update_version': ('AFTER UPDATE ON tests', [bump('test', 'NEW.id')]),
+        'trg_attempts_insert_version': ('AFTER INSERT ON attempts', [bump('attempts', 'NEW.test_id'), bump('user', 'NEW.username')]),
+        'trg_attempts_delete_version': ('AFTER DELETE ON attempts', [bump('attempts', 'OLD.test_id'), bump('user', 'OLD.username')]),
+        'trg_users_update_version': ('AFTER UPDATE ON users', [bump('user', 'NEW.username')]),
+    }
+    for name, (event, statements) in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {' '.join(statements)} END")
+
+
+def _m009_question_similarity(conn):
+    # MinHash signatures and LSH buckets of questions, see similarity.py.
+    import similarity
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS question_signatures (
+        question_id INTEGER PRIMARY KEY,
+        signature BLOB NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS question_lsh (
+        bucket INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        PRIMARY KEY (bucket, question_id)
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_question_lsh_question ON question_lsh (question_id)")
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_questions_delete_similarity AFTER DELETE ON questions BEGIN
+        DELETE FROM question_signatures WHERE question_id = OLD.id;
+        DELETE FROM question_lsh WHERE question_id = OLD.id;
+    END''')
+    similarity.index_all(conn)
+
+
+def _m010_question_search(conn):
+    # Full-text index of question text and options ('|'-separated options
+    # tokenize as separate words), kept in sync with questions by triggers.
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+        question, options,
+        content='questions', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts (rowid, question, options) VALUES (NEW.id, NEW.question, NEW.options);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_questions_fts_delete AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts (questions_fts, rowid, question, options)
+        VALUES ('delete', OLD.id, OLD.question, OLD.options);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_questions_fts_update AFTER UPDATE OF question, options ON questions BEGIN
+        INSERT INTO questions_fts (questions_fts, rowid, question, options)
+        VALUES ('delete', OLD.id, OLD.question, OLD.options);
+        INSERT INTO questions_fts (rowid, question, options) VALUES (NEW.id, NEW.question, NEW.options);
+    END''')
+    conn.execute("INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')")
+
+
+def _m011_score_histograms(conn):
+    # Attempts per (test, score), kept current by triggers, so percentile
+    # ranks read a handful of rows per test however many attempts it has.
+    conn.execute('''CREATE TABLE IF NOT EXISTS score_histogram (
+        test_id INTEGER NOT NULL,
+        score INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (test_id, score)
+    ) WITHOUT ROWID''')
+    conn.execute("DELETE FROM score_histogram")
+    conn.execute('''INSERT INTO score_histogram (test_id, score, count)
+        SELECT test_id, score, COUNT(*) FROM attempts
+        WHERE test_id IS NOT NULL AND score IS NOT NULL
+        GROUP BY test_id, score''')
+
+    add = '''INSERT INTO score_histogram (test_id, score, count)
+        SELECT NEW.test_id, NEW.score, 1 WHERE NEW.test_id IS NOT NULL AND NEW.score IS NOT NULL
+        ON CONFLICT (test_id, score) DO UPDATE SET count = count + 1;'''
+    remove = "UPDATE score_histogram SET count = count - 1 WHERE test_id = OLD.test_id AND score = OLD.score;"
+    # Every attempt moves the percentiles shown next to other students'
+    # attempts on /stats, so it also bumps one counter per database.
+    bump = '''INSERT INTO data_versions (scope, key, version) VALUES ('attempts', '*', 1)
+        ON CONFLICT (scope, key) DO UPDATE SET version = version + 1;'''
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_attempts_insert_histogram AFTER INSERT ON attempts
+        WHEN NEW.test_id IS NOT NULL AND NEW.score IS NOT NULL BEGIN {add} {bump} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_attempts_delete_histogram AFTER DELETE ON attempts
+        WHEN OLD.test_id IS NOT NULL AND OLD.score IS NOT NULL BEGIN {remove} {bump} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_attempts_update_histogram AFTER UPDATE OF test_id, score ON attempts
+        BEGIN {remove} {add} {bump} END''')
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attempts_test_rank ON attempts (test_id, score DESC, timestamp, username)")
+
+
+MIGRATIONS = [
+    (1, "base schema", _m001_base_schema),
+    (2, "indexes and unique constraints", _m002_indexes_and_constraints),
+    (3, "question pools", _m003_question_pools),
+    (4, "autosaved answer drafts", _m004_answer_drafts),
+    (5, "per-question attempt responses", _m005_attempt_responses),
+    (6, "test lifecycle and result summaries", _m006_test_lifecycle),
+    (7, "storage shards", _m007_storage_shards),
+    (8, "data version counters", _m008_data_versions),
+    (9, "question similarity index", _m009_question_similarity),
+    (10, "question full-text search", _m010_question_search),
+    (11, "score histograms and leaderboards", _m011_score_histograms),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None, verbose=False):
+    """Bring the database up to the latest schema version. Safe to call on
+    every start and from several processes at once."""
+    conn = conn or get_db()
+    if conn.in_transaction:
+        conn.commit()
+
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have won the race while we waited for the lock.
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {version:d}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        if verbose:
+            print(f"✅ Applied migration {version}: {description}")
+    return applied
+
+
+def _reset_after_fork():
+    # A forked child must never reuse the parent's SQLite handles.
+    global _pool, _local
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+
+import storage
+from analytics import FIRST_OPTION, NOT_PRESENTED
+
+# Rows pulled from SQLite per round trip while streaming.
+FETCH_SIZE = 1000
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+def iter_attempts(test_id, total, bank=None, fetch_size=FETCH_SIZE):
+    """Yield one dict per attempt at a test, oldest first. With a question
+    `bank` each dict also has 'responses': {qid: chosen option, '' if left
+    blank, None if the question was not on the student's paper}.
+
+    Uses its own connection rather than the request's pooled one: the
+    response body is still being produced after the request has torn down."""
+    conn = storage.for_test(test_id).connect()
+    try:
+        cur = conn.execute('''
+            SELECT username, score, timestamp, responses FROM attempts
+            WHERE test_id = ? ORDER BY rowid
+        ''', (test_id,))
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for username, score, timestamp, responses in rows:
+                attempt = {
+                    'username': username,
+                    'score': score,
+                    'percentage': round((score / total) * 100, 2) if total else 0,
+                    'timestamp': timestamp,
+                }
+                if bank is not None:
+                    attempt['responses'] = _decode(bank, responses)
+                yield attempt
+    finally:
+        conn.close()
+
+
+def _decode(bank, responses):
+    decoded = {}
+    for i, q in enumerate(bank.questions):
+        code = responses[i] if responses and i < len(responses) else NOT_PRESENTED
+        if code == NOT_PRESENTED:
+            decoded[q['id']] = None
+        elif code < FIRST_OPTION or code - FIRST_OPTION >= len(q['options']):
+            decoded[q['id']] = ''
+        else:
+            decoded[q['id']] = q['options'][code - FIRST_OPTION]
+    return decoded
+
+
+def stream_csv(attempts, bank=None, batch=FETCH_SIZE):
+    """CSV text in chunks of `batch` rows, header first."""
+    buffer = io.StringIO()
+    out = csv.writer(buffer)
+    header = ['username', 'score', 'percentage', 'timestamp']
+    if bank is not None:
+        header += [f"q{q['id']}" for q in bank.questions]
+    out.writerow(header)
+    yield _drain(buffer)
+
+    pending = 0
+    for attempt in attempts:
+        row = [attempt['username'], attempt['score'], attempt['percentage'], attempt['timestamp']]
+        if bank is not None:
+            row += [attempt['responses'][q['id']] or '' for q in bank.questions]
+        out.writerow(row)
+        pending += 1
+        if pending >= batch:
+            yield _drain(buffer)
+            pending = 0
+    if pending:
+        yield _drain(buffer)
+
+
+def stream_ndjson(attempts, batch=FETCH_SIZE):
+    """One JSON object per line, in chunks of `batch` lines."""
+    lines = []
+    for attempt in attempts:
+        if 'responses' in attempt:
+            attempt['responses'] = {str(qid): r for qid, r in attempt['responses'].items() if r is not None}
+        lines.append(json.dumps(attempt, ensure_ascii=False) + '\n')
+        if len(lines) >= batch:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def stream(test_id, total, fmt='csv', bank=None):
+    attempts = iter_attempts(test_id, total, bank)
+    if fmt == 'ndjson':
+        return stream_ndjson(attempts)
+    return stream_csv(attempts, bank)
+
+
+def _drain(buffer):
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
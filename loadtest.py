@@ -0,0 +1,241 @@
+"""Exam-day load test.
+
+Seeds a throwaway database with faculty, published tests and students, then
+has every student go through login -> dashboard -> exam -> submit -> result
+concurrently against the real Flask app, and prints per-route latency.
+
+    python loadtest.py --students 500 --concurrency 50
+    python loadtest.py --server          # over HTTP via a local werkzeug server
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+CATEGORIES = ('aptitude', 'verbal', 'communication')
+QUESTION_RE = re.compile(r'name="q(\d+)"[^>]*value="([^"]*)"')
+
+
+# ========== SEEDING ==========
+def seed(conn, faculty, tests, students, questions, password='pw'):
+    start = (date.today() - timedelta(days=1)).isoformat()
+    end = (date.today() + timedelta(days=7)).isoformat()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (username, password, role) VALUES (?, ?, 'faculty')",
+            ((f"faculty{i}", password) for i in range(faculty))
+        )
+        conn.executemany(
+            "INSERT INTO users (username, password, role) VALUES (?, ?, 'student')",
+            ((f"student{i}", password) for i in range(students))
+        )
+        for t in range(tests):
+            category = CATEGORIES[t % len(CATEGORIES)]
+            cur = conn.execute('''
+                INSERT INTO tests (category, total_qs, start_date, end_date, duration, published, created_by)
+                VALUES (?, ?, ?, ?, 30, 1, ?)
+            ''', (category, questions, start, end, f"faculty{t % max(faculty, 1)}"))
+            test_id = cur.lastrowid
+            conn.executemany('''
+                INSERT INTO questions (test_id, question, options, answer, upload_time)
+                VALUES (?, ?, ?, ?, datetime('now'))
+            ''', (
+                (test_id, f"Test {test_id} question {q}?", f"A{q}|B{q}|C{q}|D{q}", f"A{q}")
+                for q in range(questions)
+            ))
+
+
+# ========== CLIENTS ==========
+class TestClientSession:
+    """Drives the app in-process through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """Drives a running server over real HTTP, keeping cookies per student."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode(errors='replace')
+
+
+# ========== SCENARIO ==========
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, session, route, expected, method, path, data=None):
+        started = time.perf_counter()
+        try:
+            status, body = session.request(method, path, data)
+        except Exception:
+            status, body = None, ''
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            if status != expected:
+                self.errors[route] += 1
+        return status == expected, body
+
+
+def student_flow(make_session, recorder, username, category, rng, password='pw'):
+    session = make_session()
+    ok, _ = recorder.call(session, 'POST /login', 302, 'POST', '/login',
+                          {'username': username, 'password': password, 'role': 'student'})
+    if not ok:
+        return
+    recorder.call(session, 'GET /student_dashboard', 200, 'GET', '/student_dashboard')
+    ok, page = recorder.call(session, 'GET /exam/<category>', 200, 'GET', f'/exam/{category}')
+    if not ok:
+        return
+
+    options = defaultdict(list)
+    for qid, value in QUESTION_RE.findall(page):
+        options[qid].append(value)
+    answers = {f"q{qid}": rng.choice(values) for qid, values in options.items()}
+
+    recorder.call(session, 'POST /exam/<category>', 200, 'POST', f'/exam/{category}', answers)
+    recorder.call(session, 'GET /result/<category>', 200, 'GET', f'/result/{category}')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def report(recorder, wall_time):
+    rows = []
+    for route, values in recorder.latencies.items():
+        values = sorted(values)
+        rows.append({
+            'route': route,
+            'requests': len(values),
+            'errors': recorder.errors.get(route, 0),
+            'rps': len(values) / wall_time if wall_time else 0.0,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': values[-1] * 1000,
+        })
+    return rows
+
+
+def print_report(rows, wall_time):
+    total = sum(r['requests'] for r in rows)
+    errors = sum(r['errors'] for r in rows)
+    print(f"\n{total} requests in {wall_time:.2f}s ({total / wall_time:.1f} req/s), {errors} errors\n")
+    print(f"{'route':<26}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for r in rows:
+        print(f"{r['route']:<26}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+
+
+# ========== MAIN ==========
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--faculty', type=int, default=5)
+    parser.add_argument('--tests', type=int, default=30)
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--questions', type=int, default=20, help="questions per test")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', action='store_true', help="go through a local werkzeug HTTP server")
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    parser.add_argument('--database', metavar='PATH',
+                        help="where to create the database: a new file (e.g. under /dev/shm) or :memory: "
+                             "(default: a temporary directory)")
+    args = parser.parse_args(argv)
+    if args.tests < 1:
+        parser.error("--tests must be at least 1")
+
+    if args.database is None:
+        args.database = os.path.join(tempfile.mkdtemp(prefix='portal-load-'), 'database.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import database
+    from app import create_app
+    app = create_app({'DATABASE': args.database, 'INIT_DB': True})
+
+    with app.app_context():
+        seed(database.get_db(), args.faculty, args.tests, args.students, args.questions)
+
+    server = None
+    if args.server:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        make_session = lambda: HTTPSession(base_url)
+    else:
+        make_session = lambda: TestClientSession(app)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    # Only categories seed() gave a published test.
+    categories = CATEGORIES[:min(args.tests, len(CATEGORIES))]
+    jobs = [(f"student{i}", categories[i % len(categories)], random.Random(rng.random()))
+            for i in range(args.students)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for username, category, student_rng in jobs:
+            pool.submit(student_flow, make_session, recorder, username, category, student_rng)
+    wall_time = time.perf_counter() - started
+
+    if server is not None:
+        server.shutdown()
+
+    rows = report(recorder, wall_time)
+    print(f"database: {database.DATABASE}")
+    print_report(rows, wall_time)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'wall_time': wall_time, 'routes': rows}, f, indent=2)
+
+    return 1 if any(r['errors'] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
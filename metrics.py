@@ -0,0 +1,353 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+
+# Latency buckets in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Seconds between writes of a process's samples to the shared directory.
+SHARE_INTERVAL = 5
+
+_metrics = []
+_shared_dir = None      # see share()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    inner = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + inner + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def collect(self):
+        return self.format(self.samples())
+
+    def reset(self):
+        # In a forked child: the parent's lock may have been held, and its
+        # counts are the parent's work, not the child's.
+        self._lock = threading.Lock()
+        if hasattr(self, '_values'):
+            self._values = {}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def format(self, samples):
+        lines = self.header()
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}   # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+    def format(self, samples):
+        lines = self.header()
+        for key, state in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = key + (('le', _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return lines
+
+
+class Callback(_Metric):
+    """A gauge or counter whose samples are read from `fn` at scrape time.
+    `fn` returns a number, or an iterable of (labels dict, number)."""
+
+    def __init__(self, name, documentation, fn, type='gauge'):
+        super().__init__(name, documentation)
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        samples = self.fn()
+        if isinstance(samples, (int, float)):
+            samples = [({}, samples)]
+        return {tuple(sorted(labels.items())): value for labels, value in samples}
+
+    def format(self, samples):
+        lines = self.header()
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+# ========== SHARING BETWEEN PROCESSES ==========
+# Preforked workers (serve.py) each count their own requests, and a scrape
+# reaches whichever worker accepts it. With share(), every process writes
+# its samples to a directory and render() sums the files of all of them,
+# so /metrics reports the whole server whichever worker answers.
+
+def share(directory, interval=SHARE_INTERVAL):
+    """Publish this process's samples under `directory` every `interval`
+    seconds (and on every render), and include the other processes' in render()."""
+    global _shared_dir
+    _shared_dir = directory
+    publish()
+    threading.Thread(target=_share_forever, args=(directory, interval), name='metrics-share', daemon=True).start()
+
+
+def _share_forever(directory, interval):
+    while _shared_dir == directory:
+        time.sleep(interval)
+        try:
+            publish()
+        except OSError as e:
+            print(f"⚠️ Could not share metrics: {e}")
+
+
+def publish():
+    """Write this process's samples to the shared directory now (e.g. on exit)."""
+    directory = _shared_dir
+    if directory is None:
+        return
+    data = {metric.name: [[list(map(list, key)), value] for key, value in metric.samples().items()]
+            for metric in list(_metrics)}
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    partial = f"{path}.tmp"
+    with open(partial, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(partial, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shared_samples():
+    """{metric name: samples} summed over every process sharing the directory.
+    Processes that exited still count towards counters and histograms, which
+    must never go down, but no longer towards gauges."""
+    merged = {metric.name: {} for metric in _metrics}
+    types = {metric.name: metric.type for metric in _metrics}
+    for entry in os.scandir(_shared_dir):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _alive(int(entry.name[:-len('.json')]))
+        for name, items in data.items():
+            if name not in merged or (types[name] == 'gauge' and not alive):
+                continue
+            samples = merged[name]
+            for key, value in items:
+                key = tuple(map(tuple, key))
+                if key not in samples:
+                    samples[key] = value
+                elif isinstance(value, list):
+                    samples[key] = [a + b for a, b in zip(samples[key], value)]
+                else:
+                    samples[key] += value
+    return merged
+
+
+def render():
+    lines = []
+    if _shared_dir is not None:
+        publish()
+        merged = _shared_samples()
+        for metric in list(_metrics):
+            lines.extend(metric.format(merged[metric.name]))
+    else:
+        for metric in list(_metrics):
+            lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ========== BUILT-IN METRICS ==========
+REQUEST_LATENCY = Histogram(
+    'portal_http_request_duration_seconds', "Time spent handling a request.", ('endpoint', 'method'))
+REQUESTS = Counter(
+    'portal_http_requests_total', "Requests handled.", ('endpoint', 'method', 'status'))
+REQUEST_SQL_STATEMENTS = Histogram(
+    'portal_request_sql_statements', "SQL statements executed per request.", ('endpoint',),
+    buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'portal_request_sql_seconds', "Time spent in SQL per request.", ('endpoint',))
+SQL_STATEMENTS = Counter('portal_sql_statements_total', "SQL statements executed.")
+SQL_SECONDS = Counter('portal_sql_seconds_total', "Time spent executing SQL statements.")
+CONNECTIONS_OPENED = Counter('portal_db_connections_opened_total', "SQLite connections opened.")
+
+_caches = {}
+
+
+def register_cache(name, hits_and_misses):
+    """Expose a cache's hit/miss counters. `hits_and_misses` returns (hits, misses)."""
+    _caches[name] = hits_and_misses
+
+
+Callback('portal_cache_hits_total', "Cache lookups served from memory.",
+         lambda: [({'cache': name}, fn()[0]) for name, fn in sorted(_caches.items())], type='counter')
+Callback('portal_cache_misses_total', "Cache lookups that had to load from the database.",
+         lambda: [({'cache': name}, fn()[1]) for name, fn in sorted(_caches.items())], type='counter')
+
+
+# ========== SQL INSTRUMENTATION ==========
+def _record_sql(elapsed):
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(elapsed)
+    if has_request_context():
+        g._sql_statements = g.get('_sql_statements', 0) + 1
+        g._sql_seconds = g.get('_sql_seconds', 0.0) + elapsed
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_sql(time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Pass as `factory=` to sqlite3.connect to time every statement."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+
+# ========== REQUEST INSTRUMENTATION ==========
+def _start_timer():
+    g._request_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    statements = g.get('_sql_statements', 0)
+    sql_seconds = g.get('_sql_seconds', 0.0)
+
+    REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_SQL_STATEMENTS.observe(statements, endpoint=endpoint)
+    REQUEST_SQL_SECONDS.observe(sql_seconds, endpoint=endpoint)
+
+    if current_app.config.get('METRICS_TIMING_HEADERS'):
+        response.headers['X-Response-Time'] = f"{elapsed * 1000:.1f}ms"
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={sql_seconds * 1000:.1f};desc="{statements} queries"'
+        )
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_TIMING_HEADERS', False)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+
+def _reset_after_fork():
+    # The child shares its samples (if at all) under its own pid.
+    global _shared_dir
+    _shared_dir = None
+    for metric in _metrics:
+        metric.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
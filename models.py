@@ -1,116 +1,91 @@
+import base64
+import json
+import re
 import sqlite3
 from datetime import datetime
 
-DB_NAME = 'database.db'
+import analytics
+import autosave
+import papers
+import registry
+import similarity
+import snapshot
+import storage
+import writer
+from database import get_db, migrate
 
 # ========== INIT DB ==========
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-
-    # Users table
-    cur.execute('''CREATE TABLE IF NOT EXISTS users (
-        username TEXT NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL
-    )''')
-
-    # Tests table
-    cur.execute('''CREATE TABLE IF NOT EXISTS tests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category TEXT NOT NULL,
-        total_qs INTEGER NOT NULL,
-        start_date TEXT,
-        end_date TEXT,
-        duration INTEGER,
-        published INTEGER DEFAULT 0,
-        created_by TEXT
-    )''')
-
-    # Questions table
-    cur.execute('''CREATE TABLE IF NOT EXISTS questions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        test_id INTEGER,
-        question TEXT,
-        options TEXT,
-        answer TEXT,
-        upload_time TEXT
-    )''')
-
-    # Attempts table
-    cur.execute('''CREATE TABLE IF NOT EXISTS attempts (
-        username TEXT NOT NULL,
-        category TEXT NOT NULL,
-        test_id INTEGER,
-        score INTEGER NOT NULL,
-        timestamp TEXT NOT NULL
-    )''')
-
-    conn.commit()
-    conn.close()
-
-
-# ========== DB Maintenance ==========
-def add_score_column():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    try:
-        cur.execute("ALTER TABLE attempts ADD COLUMN score INTEGER")
-        print("✅ 'score' column added to 'attempts' table.")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            print("⚠️ 'score' column already exists.")
-        else:
-            raise e
-    conn.commit()
-    conn.close()
+    # Creates the schema on a fresh database and upgrades an existing one,
+    # then does the same for every storage shard.
+    applied = migrate(get_db())
+    storage.migrate()
+    return applied
+
 
-def add_test_id_column():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+# ========== PAGINATION ==========
+# Lists are paged by keyset ("everything after the last row shown") rather
+# than OFFSET, so a page costs the same however far back it is.
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def page_limit(limit, default=PAGE_SIZE):
     try:
-        cur.execute("ALTER TABLE attempts ADD COLUMN test_id INTEGER")
-        print("✅ 'test_id' column added to 'attempts' table.")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            print("⚠️ 'test_id' column already exists.")
-        else:
-            raise
-    conn.commit()
-    conn.close()
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, types=(int,)):
+    """The key packed by encode_cursor, or None for a missing or mangled
+    cursor. `types` holds the type (or tuple of types) of each key element."""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    for value, expected in zip(key, types):
+        if isinstance(value, bool) or not isinstance(value, expected):
+            return None
+    return key
+
+def _page(rows, limit, key):
+    # Queries fetch limit + 1 rows; the extra one only says whether there is a next page.
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(*key(rows[-1]))
+    return rows, None
 
 
 # ========== USERS ==========
 def add_user(username, password, role):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     try:
-        conn.execute(
-            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-            (username.lower().strip(), password.strip(), role.lower().strip())
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(
+                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                (username.lower().strip(), password.strip(), role.lower().strip())
+            )
         return True
     except sqlite3.IntegrityError:
-        conn.close()
         return False
+
 def get_user(username, password, role):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_db().execute(
         "SELECT * FROM users WHERE username=? AND password=? AND role=?",
         (username.lower().strip(), password.strip(), role.lower().strip())
     )
-    user = cur.fetchone()
-    conn.close()
-    return user
+    return cur.fetchone()
 
 def get_user_by_username(username):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT username, role FROM users WHERE username = ?", (username,))
+    cur = get_db().execute("SELECT username, role FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
-    conn.close()
 
     if row:
         return {
@@ -121,215 +96,485 @@ def get_user_by_username(username):
     else:
         return None
 
+def update_password(username, role, new_password):
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "UPDATE users SET password = ? WHERE username = ? AND role = ?",
+            (new_password, username, role)
+        )
+
 
 
 # ========== TESTS ==========
-def create_test(category, total_qs, duration, start_date, end_date, created_by):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO tests (category, total_qs, duration, start_date, end_date, created_by)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (category, total_qs, duration, start_date, end_date, created_by))
-    conn.commit()
-    test_id = cur.lastrowid
-    conn.close()
-    return test_id
-
-def get_all_tests():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tests ORDER BY id DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+TEST_COLUMNS = "id, category, total_qs, start_date, end_date, duration, published, created_by, pool_size"
+
+def create_test(category, total_qs, duration, start_date, end_date, created_by, pool_size=None):
+    if pool_size is not None and pool_size <= total_qs:
+        pool_size = None  # a pool no larger than the paper is just a fixed paper
+    conn = get_db()
+    with conn:
+        cur = conn.execute('''
+            INSERT INTO tests (category, total_qs, duration, start_date, end_date, created_by, pool_size, shard)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (category, total_qs, duration, start_date, end_date, created_by, pool_size,
+              storage.shard_name_for_category(category)))
+    registry.invalidate()
+    return cur.lastrowid
+
+def get_all_tests(limit=PAGE_SIZE, cursor=None):
+    """One page of tests, newest first, and the cursor of the next page."""
+    limit = page_limit(limit)
+    after = decode_cursor(cursor)
+    cur = get_db().execute(
+        f"SELECT {TEST_COLUMNS} FROM tests WHERE id < ? ORDER BY id DESC LIMIT ?",
+        (after[0] if after else 2 ** 63 - 1, limit + 1)
+    )
+    return _page(cur.fetchall(), limit, lambda t: (t[0],))
 
 def get_test_by_id(test_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tests WHERE id=?", (test_id,))
-    test = cur.fetchone()
-    conn.close()
-    return test
+    return get_db().execute(f"SELECT {TEST_COLUMNS} FROM tests WHERE id=?", (test_id,)).fetchone()
+
+def get_test_categories(test_ids):
+    """{test_id: category} for the given tests."""
+    cur = get_db().execute(
+        "SELECT id, category FROM tests WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(test_ids)),)
+    )
+    return dict(cur.fetchall())
+
+def required_question_count(test):
+    # Questions to upload before publishing: the whole pool, or the paper.
+    return test[8] or test[2]
 
 def get_question_count_for_test(test_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM questions WHERE test_id=?", (test_id,))
-    count = cur.fetchone()[0]
-    conn.close()
-    return count
+    cur = storage.for_test(test_id).get_db().execute("SELECT COUNT(*) FROM questions WHERE test_id=?", (test_id,))
+    return cur.fetchone()[0]
+
+def get_faculty_dashboard(limit=PAGE_SIZE, cursor=None):
+    # One page of tests, newest first, each with its uploaded question and
+    # attempt counts. The counts come from whichever shard holds each test,
+    # one grouped index-only query per shard and table.
+    tests, next_cursor = get_all_tests(limit, cursor)
+    test_ids = [t[0] for t in tests]
+    uploaded = storage.count_by_test('questions', test_ids)
+    # Only published tests have attempts. Their counts may lag by the
+    # snapshot staleness bound, so this page never reads the attempts
+    # tables submissions are writing to.
+    attempts = storage.count_by_test('attempts', [t[0] for t in tests if t[6]], snapshot=True)
+    rows = [tuple(t) + (uploaded.get(t[0], 0), attempts.get(t[0], 0)) for t in tests]
+    return rows, next_cursor
+
+def publish_test(test_id):
+    conn = get_db()
+    with conn:
+        conn.execute("UPDATE tests SET published = 1 WHERE id = ?", (test_id,))
+    registry.invalidate()
+    papers.invalidate(test_id)
+
+def autopublish_if_complete(test_id):
+    # Publishes the test once every question has been uploaded.
+    test = get_test_by_id(test_id)
+    if test and test[6] == 0 and get_question_count_for_test(test_id) >= required_question_count(test):
+        publish_test(test_id)
+        return True
+    return False
 
 
 # ========== QUESTIONS ==========
 def is_duplicate_question(test_id, question_text):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute(
+    cur = storage.for_test(test_id).get_db().execute(
         "SELECT 1 FROM questions WHERE test_id=? AND question=?",
         (test_id, question_text.strip())
     )
-    exists = cur.fetchone()
-    conn.close()
-    return exists is not None
+    return cur.fetchone() is not None
 
-def add_question_to_test(test_id, question, options_list, answer):
+def clean_question(question, options_list, answer):
+    # Shared by single uploads and bulk imports; raises ValueError.
     options_cleaned = [opt.strip() for opt in options_list if opt.strip()]
 
+    if not question.strip():
+        raise ValueError("Question text is required.")
     if len(options_cleaned) < 2:
         raise ValueError("At least two unique options are required.")
     if len(set(options_cleaned)) != len(options_cleaned):
         raise ValueError("Duplicate options found.")
     if answer.strip() not in options_cleaned:
         raise ValueError("Answer must match one of the options.")
+    return question.strip(), options_cleaned, answer.strip()
+
+def add_question_to_test(test_id, question, options_list, answer):
+    """Add a question; returns the near-duplicates already in the bank (see
+    similarity.find_similar), which are reported but not rejected."""
+    test = get_test_by_id(test_id)
+    if not test:
+        raise ValueError("Test not found.")
+    if test[6] == 1:
+        # Workers cache published papers for good (see papers.get_paper).
+        raise ValueError("Test is already published. You cannot add questions.")
+    question, options_cleaned, answer = clean_question(question, options_list, answer)
     if is_duplicate_question(test_id, question):
         raise ValueError("Duplicate question found in the same test.")
 
     options_str = '|'.join(options_cleaned)
     upload_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    conn = sqlite3.connect(DB_NAME)
-    conn.execute('''
-        INSERT INTO questions (test_id, question, options, answer, upload_time)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (test_id, question.strip(), options_str, answer.strip(), upload_time))
-    conn.commit()
-    conn.close()
+    sig = similarity.signature(question)
+    similar = similarity.find_similar(sig=sig)
+
+    conn = storage.for_test(test_id).get_db()
+    with conn:
+        cur = conn.execute('''
+            INSERT INTO questions (test_id, question, options, answer, upload_time)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (test_id, question, options_str, answer, upload_time))
+        similarity.index_question(conn, cur.lastrowid, question, sig)
+    papers.invalidate(test_id)
+    return similar
 
 def get_question_by_id(qid):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT id, test_id, question, options, answer FROM questions WHERE id=?", (qid,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    cur = storage.for_question(qid).get_db().execute("SELECT id, test_id, question, options, answer FROM questions WHERE id=?", (qid,))
+    return cur.fetchone()
 
 def update_question(qid, question, options_list, answer):
-    options_str = '|'.join(options_list)
-    conn = sqlite3.connect(DB_NAME)
-    conn.execute('''
-        UPDATE questions SET question=?, options=?, answer=? WHERE id=?
-    ''', (question.strip(), options_str, answer.strip(), qid))
-    conn.commit()
-    conn.close()
+    # Raises ValueError, like add_question_to_test.
+    question, options_cleaned, answer = clean_question(question, options_list, answer)
+    conn = storage.for_question(qid).get_db()
+    try:
+        with conn:
+            conn.execute('''
+                UPDATE questions SET question=?, options=?, answer=? WHERE id=?
+            ''', (question, '|'.join(options_cleaned), answer, qid))
+            similarity.index_question(conn, qid, question)
+    except sqlite3.IntegrityError:
+        raise ValueError("Duplicate question found in the same test.")
+    papers.invalidate_question(qid)
 
 def delete_question(qid):
-    conn = sqlite3.connect(DB_NAME)
-    conn.execute("DELETE FROM questions WHERE id=?", (qid,))
-    conn.commit()
-    conn.close()
-
-def get_questions_by_test(test_id):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM questions WHERE test_id = ?", (test_id,))
-    questions = cur.fetchall()
-    conn.close()
-    return questions
+    conn = storage.for_question(qid).get_db()
+    with conn:
+        conn.execute("DELETE FROM questions WHERE id=?", (qid,))
+    papers.invalidate_question(qid)
+
+def get_questions_by_test(test_id, limit=PAGE_SIZE, cursor=None):
+    """One page of (id, question, options, answer) rows in upload order and
+    the cursor of the next page."""
+    limit = page_limit(limit)
+    after = decode_cursor(cursor)
+    cur = storage.for_test(test_id).get_db().execute('''
+        SELECT id, question, options, answer FROM questions
+        WHERE test_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (test_id, after[0] if after else 0, limit + 1))
+    return _page(cur.fetchall(), limit, lambda q: (q[0],))
+
+def count_questions_before(test_id, qid):
+    cur = storage.for_test(test_id).get_db().execute(
+        "SELECT COUNT(*) FROM questions WHERE test_id = ? AND id < ?", (test_id, qid)
+    )
+    return cur.fetchone()[0]
 
-def get_test_attempt_counts():
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT category, COUNT(*) FROM attempts GROUP BY category
-    ''')
-    result = cur.fetchall()
-    conn.close()
-    return result
+# bm25 weights of the indexed columns: question text, options.
+SEARCH_WEIGHTS = (2.0, 1.0)
 
+# Shorter last words are matched whole: a one- or two-letter prefix
+# matches so much of the bank that ranking it all gets slow.
+MIN_PREFIX = 3
 
-# ========== ATTEMPTS ==========
-def record_attempt(username, category, answers):
-    # 1. Get current test ID for the category
-    test_id = get_current_test_id(category)
-    if not test_id:
-        return 0, 0  # No test found
+def fts_query(text):
+    """User input as an FTS5 query matching every word, the last one as a
+    prefix so results show up while typing; None if it has no words."""
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"' for word in words)
+    return query + '*' if len(words[-1]) >= MIN_PREFIX else query
+
+def search_questions(text, category=None, test_id=None, limit=PAGE_SIZE, cursor=None):
+    """One page of (id, test_id, question, options, answer) rows matching
+    `text`, best match first, and the cursor of the next page. Each shard
+    ranks its matches with bm25 over the questions_fts index; pages are
+    ordered by (rank, question id), ids being unique across shards."""
+    limit = page_limit(limit)
+    query = fts_query(text)
+    if query is None:
+        return [], None
+    after = decode_cursor(cursor, types=((int, float), int))
+
+    if test_id is not None:
+        groups = storage.group_tests([test_id])
+    elif category:
+        groups = storage.group_tests([row[0] for row in get_db().execute(
+            "SELECT id FROM tests WHERE category = ?", (category,)
+        ).fetchall()])
+    else:
+        groups = {shard: None for shard in storage.shards()}
+
+    rows = []
+    for shard, ids in groups.items():
+        where, params = "questions_fts MATCH ?", [query]
+        if ids is not None:
+            where += " AND q.test_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(ids))
+        cur = shard.get_db().execute(f'''
+            SELECT id, test_id, question, options, answer, rank FROM (
+                SELECT q.id, q.test_id, q.question, q.options, q.answer,
+                       bm25(questions_fts, {SEARCH_WEIGHTS[0]}, {SEARCH_WEIGHTS[1]}) AS rank
+                FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid
+                WHERE {where}
+            )
+            WHERE (rank, id) > (?, ?)
+            ORDER BY rank, id
+            LIMIT ?
+        ''', params + [*(after or (float('-inf'), 0)), limit + 1])
+        rows += cur.fetchall()
+
+    rows.sort(key=lambda q: (q[5], q[0]))
+    rows, next_cursor = _page(rows[:limit + 1], limit, lambda q: (q[5], q[0]))
+    return [row[:5] for row in rows], next_cursor
+
+def get_categories():
+    return [row[0] for row in get_db().execute("SELECT DISTINCT category FROM tests ORDER BY category")]
+
+def get_test_attempt_counts():
+    # Summed across shards; a category can span several after a reshard.
+    counts = {}
+    for shard in storage.shards():
+        for category, count in snapshot.get_db(shard).execute(
+            "SELECT category, COUNT(*) FROM attempts GROUP BY category"
+        ).fetchall():
+            counts[category] = counts.get(category, 0) + count
+    return list(counts.items())
 
-    conn = sqlite3.connect('database.db')
-    cur = conn.cursor()
 
-    # 2. Fetch correct answers for all questions in this test
-    cur.execute("SELECT id, answer FROM questions WHERE test_id = ?", (test_id,))
-    correct_answers = dict(cur.fetchall())  # {question_id: correct_answer}
+# ========== ATTEMPTS ==========
+def grade_attempt(test, username, answers):
+    """Score {qid: answer} against this student's paper of `test`; returns
+    (score, total, responses, correct_bits)."""
+    # Correct answers for this student's paper (regenerated from its seed)
+    paper = papers.get_student_paper(test, username)
+    correct_answers = paper.answers if paper else {}  # {question_id: correct_answer}
 
-    # 3. Compare submitted answers to correct ones
     score = 0
     for qid, user_answer in answers.items():
         correct_answer = correct_answers.get(qid)
         if correct_answer and user_answer.strip().lower() == correct_answer.strip().lower():
             score += 1
 
-    total = len(correct_answers)
-
-    # 4. Record the attempt
-    cur.execute(
-        "INSERT INTO attempts (username, category, score, test_id, timestamp) VALUES (?, ?, ?, ?, datetime('now'))",
-        (username, category, score, test_id)
+    responses, correct_bits = (
+        analytics.encode_responses(papers.get_paper(test.test_id), correct_answers, answers)
+        if paper else (None, None)
     )
-    conn.commit()
-    conn.close()
+    return score, len(correct_answers), responses, correct_bits
 
-    return score, total
+def record_attempt(username, category, answers):
+    # 1. Get current test for the category
+    test = registry.get_published_test(category)
+    if not test:
+        return 0, 0  # No test found
+    test_id = test.test_id
 
+    # 2. Autosaved answers count too, so a final submission only has to
+    #    carry whatever changed since the last save.
+    saved = autosave.load(username, test_id)
+    saved.update(answers)
 
-def get_current_test_id(category):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM tests WHERE category = ? AND published = 1 ORDER BY id DESC LIMIT 1", (category,))
-    result = cur.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def get_student_attempts(username):
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT category, timestamp, score, test_id
-        FROM attempts
-        WHERE username = ?
-    ''', (username,))
-    result = cur.fetchall()
-    conn.close()
-    return result
+    # 3. Compare answers to correct ones
+    score, total, responses, correct_bits = grade_attempt(test, username, saved)
 
+    # 4. Record the attempt through the writer of the test's shard, which
+    #    group-commits concurrent submissions; blocks until ours is durable.
+    def insert_attempt(conn):
+        conn.execute(
+            "INSERT INTO attempts (username, category, score, test_id, timestamp, responses, correct_bits) "
+            "VALUES (?, ?, ?, ?, datetime('now'), ?, ?)",
+            (username, category, score, test_id, responses, correct_bits)
+        )
+        autosave.delete_draft(conn, username, test_id)
 
-# ========== EXAM QUESTIONS ==========
-def get_exam_questions(category):
-    test_id = get_current_test_id(category)
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("SELECT * FROM questions WHERE test_id = ?", (test_id,))
-    questions = []
-    for row in cur.fetchall():
-        options = row['options'].split('|')  # Must split string into list
-        questions.append({
-            'id': row['id'],
-            'question': row['question'],
-            'options': options,
-            'answer': row['answer']
-        })
-    conn.close()
-    return questions
-
-# ========== DB Maintenance ==========
-def add_test_id_column():
-    conn = sqlite3.connect('database.db')
-    cur = conn.cursor()
-    try:
-        cur.execute("ALTER TABLE attempts ADD COLUMN test_id INTEGER")
-        print("✅ 'test_id' column added to 'attempts' table.")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            print("⚠️ 'test_id' column already exists.")
-        else:
-            raise
-    conn.commit()
-    conn.close()
+    storage.for_test(test_id).write(insert_attempt)
+    # Only now: if the write failed, buffered answers are still flushed to
+    # the draft, and flushes after this point skip the submitted attempt.
+    autosave.discard(username, test_id)
+
+    return score, total
 
 
+def get_current_test_id(category):
+    test = registry.get_published_test(category)
+    return test.test_id if test else None
 
+def get_attempt(username, test_id):
+    cur = storage.for_test(test_id).get_db().execute(
+        "SELECT score FROM attempts WHERE username = ? AND test_id = ?", (username, test_id)
+    )
+    return cur.fetchone()
+
+def get_student_attempts(username, limit=PAGE_SIZE, cursor=None):
+    """One page of (category, timestamp, score, test_id) rows, most recent
+    first, and the cursor of the next page. Each shard walks ix_attempts_user,
+    whose entries end in the rowid; pages are ordered by (timestamp, shard
+    number, rowid) so ties break the same way across shards."""
+    limit = page_limit(limit)
+    after = decode_cursor(cursor, types=(str, int, int))
+    rows = []
+    for shard in storage.shards():
+        if not after:
+            where, params = "username = ?", (username,)
+        elif shard.number < after[1]:
+            where, params = "username = ? AND timestamp <= ?", (username, after[0])
+        elif shard.number == after[1]:
+            where, params = "username = ? AND (timestamp, rowid) < (?, ?)", (username, after[0], after[2])
+        else:
+            where, params = "username = ? AND timestamp < ?", (username, after[0])
+        cur = shard.get_db().execute(f'''
+            SELECT category, timestamp, score, test_id, rowid
+            FROM attempts
+            WHERE {where}
+            ORDER BY timestamp DESC, rowid DESC
+            LIMIT ?
+        ''', params + (limit + 1,))
+        rows += [row[:4] + (shard.number, row[4]) for row in cur.fetchall()]
+
+    rows.sort(key=lambda a: (a[1], a[4], a[5]), reverse=True)
+    rows, next_cursor = _page(rows[:limit + 1], limit, lambda a: (a[1], a[4], a[5]))
+    return [row[:4] for row in rows], next_cursor
+
+def get_attempted_test_ids(username, test_ids):
+    """Which of `test_ids` the student has already attempted."""
+    attempted = set()
+    for shard, ids in storage.group_tests(test_ids).items():
+        cur = shard.get_db().execute('''
+            SELECT test_id FROM attempts
+            WHERE username = ? AND test_id IN (SELECT value FROM json_each(?))
+        ''', (username, json.dumps(ids)))
+        attempted.update(row[0] for row in cur.fetchall())
+    return attempted
+
+
+# ========== RANKINGS ==========
+LEADERBOARD_SIZE = 10
+
+def get_score_ranks(scores):
+    """{(test_id, score): (rank, percentile, attempts)} for (test_id, score)
+    pairs, read from the score histograms: a few rows per test whatever its
+    number of attempts. Rank counts better scores; the percentile is the
+    share of attempts scoring lower, plus half of the ties."""
+    ranks = {}
+    by_test = {}
+    for test_id, score in scores:
+        by_test.setdefault(test_id, set()).add(score)
+    for shard, ids in storage.group_tests(list(by_test)).items():
+        pairs = [[test_id, score] for test_id in ids for score in by_test[test_id]]
+        cur = shard.get_db().execute('''
+            WITH wanted (test_id, score) AS (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+            )
+            SELECT w.test_id, w.score,
+                   TOTAL(h.count) FILTER (WHERE h.score > w.score),
+                   TOTAL(h.count) FILTER (WHERE h.score = w.score),
+                   TOTAL(h.count)
+            FROM wanted w JOIN score_histogram h ON h.test_id = w.test_id
+            GROUP BY w.test_id, w.score
+        ''', (json.dumps(pairs),))
+        for test_id, score, above, equal, total in cur.fetchall():
+            if total:
+                below = total - above - equal
+                ranks[(test_id, score)] = (int(above) + 1, round((below + equal / 2) / total * 100), int(total))
+    return ranks
+
+def get_score_rank(test_id, score):
+    return get_score_ranks([(test_id, score)]).get((test_id, score))
+
+def get_leaderboard(test_id, limit=LEADERBOARD_SIZE):
+    """Top (username, score, timestamp) rows of a test, earliest first among
+    equal scores; walks ix_attempts_test_rank, so it reads only `limit` rows."""
+    cur = storage.for_test(test_id).get_db().execute('''
+        SELECT username, score, timestamp FROM attempts
+        WHERE test_id = ?
+        ORDER BY score DESC, timestamp, username
+        LIMIT ?
+    ''', (test_id, limit))
+    return cur.fetchall()
 
 
+# ========== EXAM QUESTIONS ==========
+def get_exam_questions(category):
+    test_id = get_current_test_id(category)
+    paper = papers.get_paper(test_id) if test_id else None
+    if not paper:
+        return []
+    return [dict(q, answer=paper.answers[q['id']]) for q in paper.questions]
+
+
+# ========== TEST LIFECYCLE ==========
+def get_unclosed_tests():
+    """Published tests the scheduler has not closed yet, as PublishedTest."""
+    cur = get_db().execute('''
+        SELECT id, category, total_qs, start_date, end_date, duration, pool_size
+        FROM tests WHERE published = 1 AND closed_at IS NULL
+    ''')
+    return [
+        registry.PublishedTest(test_id, category, total_qs, registry.parse_date(start_date),
+                               registry.parse_date(end_date), duration, pool_size)
+        for test_id, category, total_qs, start_date, end_date, duration, pool_size in cur.fetchall()
+    ]
+
+def finalize_drafts(test):
+    """Grade the autosaved answers of students who never submitted, as of
+    their last save. Returns the number of attempts recorded."""
+    shard = storage.for_test(test.test_id)
+    cur = shard.get_db().execute('''
+        SELECT d.username, d.answers, d.updated_at FROM attempt_answers d
+        WHERE d.test_id = ? AND NOT EXISTS (
+            SELECT 1 FROM attempts a WHERE a.username = d.username AND a.test_id = d.test_id
+        )
+    ''', (test.test_id,))
+    rows = []
+    for username, answers, updated_at in cur.fetchall():
+        answers = {int(qid): answer for qid, answer in json.loads(answers).items()}
+        score, total, responses, correct_bits = grade_attempt(test, username, answers)
+        rows.append((username, test.category, score, test.test_id, updated_at, responses, correct_bits))
+
+    def insert_attempts(conn):
+        # OR IGNORE: a submission may have landed since the drafts were read.
+        conn.executemany(
+            "INSERT OR IGNORE INTO attempts (username, category, score, test_id, timestamp, responses, correct_bits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        conn.execute("DELETE FROM attempt_answers WHERE test_id = ?", (test.test_id,))
+
+    shard.write(insert_attempts)
+    return len(rows)
+
+def compute_test_summary(test_id):
+    """Aggregate a test's scores (from its shard) into test_summaries, which
+    lives in the main database, and return the row."""
+    conn = storage.for_test(test_id).get_db()
+    attempts, mean_score, min_score, max_score = conn.execute(
+        "SELECT COUNT(*), AVG(score), MIN(score), MAX(score) FROM attempts WHERE test_id = ?", (test_id,)
+    ).fetchone()
+    histogram = dict(conn.execute(
+        "SELECT score, COUNT(*) FROM attempts WHERE test_id = ? GROUP BY score", (test_id,)
+    ).fetchall())
+    row = (test_id, attempts, mean_score, min_score, max_score,
+           json.dumps({str(score): count for score, count in histogram.items()}))
+    writer.write(lambda conn: conn.execute('''
+        INSERT OR REPLACE INTO test_summaries
+            (test_id, attempts, mean_score, min_score, max_score, score_histogram, computed_at)
+        VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+    ''', row))
+    return row
 
+def mark_test_closed(test_id):
+    writer.write(lambda conn: conn.execute(
+        "UPDATE tests SET closed_at = datetime('now') WHERE id = ? AND closed_at IS NULL", (test_id,)
+    ))
+
+def get_test_summaries(test_ids):
+    """{test_id: (attempts, mean_score, min_score, max_score)} for closed tests."""
+    cur = get_db().execute('''
+        SELECT test_id, attempts, mean_score, min_score, max_score FROM test_summaries
+        WHERE test_id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(test_ids)),))
+    return {row[0]: row[1:] for row in cur.fetchall()}
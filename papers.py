@@ -0,0 +1,169 @@
+import hashlib
+import os
+import random
+import threading
+from collections import OrderedDict
+
+from flask import render_template
+from markupsafe import Markup
+
+import metrics
+import storage
+import versions
+
+# Compiled papers kept in memory; least recently used ones are evicted first.
+MAX_PAPERS = 64
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def values(self):
+        with self._lock:
+            return list(self._data.values())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def after_fork(self):
+        # A parent thread may have held the lock when the process forked;
+        # the cached values themselves are kept, that is what warming is for.
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+
+class ExamPaper:
+    """Parsed questions of one test plus its rendered question list.
+    `version` is the test's data version when the paper was loaded from an
+    unpublished test, whose questions may still change; None otherwise."""
+
+    def __init__(self, test_id, questions, answers=None, version=None):
+        self.test_id = test_id
+        self.version = version
+        self.questions = tuple(
+            {'id': q['id'], 'question': q['question'], 'options': tuple(q['options'])}
+            for q in questions
+        )
+        self.answers = answers if answers is not None else {q['id']: q['answer'] for q in questions}
+        self._html = None
+
+    def draw(self, username, count):
+        """The paper one student sees when the test has a question pool:
+        `count` questions from the bank, in shuffled order with shuffled
+        options. Seeded by (test, student), so it is identical on reload and
+        at grading time without being stored anywhere."""
+        digest = hashlib.sha256(f"{self.test_id}:{username}".encode()).digest()
+        rng = random.Random(int.from_bytes(digest[:8], 'big'))
+
+        picked = rng.sample(self.questions, min(count, len(self.questions)))
+        questions = []
+        for q in picked:
+            options = list(q['options'])
+            rng.shuffle(options)
+            questions.append({'id': q['id'], 'question': q['question'], 'options': options})
+        return ExamPaper(self.test_id, questions, {q['id']: self.answers[q['id']] for q in picked})
+
+    def render(self):
+        # Rendered once per paper; needs an app context the first time.
+        if self._html is None:
+            self._html = Markup(render_template('exam_questions.html', questions=self.questions))
+        return self._html
+
+
+_papers = LRUCache(MAX_PAPERS)
+metrics.register_cache('exam_papers', lambda: (_papers.hits, _papers.misses))
+
+
+def _is_published(test_id):
+    row = storage.MAIN.get_db().execute("SELECT published FROM tests WHERE id = ?", (test_id,)).fetchone()
+    return bool(row and row[0])
+
+
+def _load_paper(test_id, version=None):
+    cur = storage.for_test(test_id).get_db().execute(
+        "SELECT id, question, options, answer FROM questions WHERE test_id = ? ORDER BY id",
+        (test_id,)
+    )
+    questions = [
+        {'id': qid, 'question': text, 'options': options.split('|'), 'answer': answer}
+        for qid, text, options, answer in cur.fetchall()
+    ]
+    return ExamPaper(test_id, questions, version=version) if questions else None
+
+
+def get_paper(test_id):
+    """The test's paper, or None if it has no questions. Papers of published
+    tests never change and are served from memory; a cached paper of an
+    unpublished test is only reused while the test's data version is
+    unchanged, since another process may have edited or imported questions."""
+    paper = _papers.get(test_id)
+    if paper is not None and paper.version is None:
+        return paper
+    version = None if _is_published(test_id) else versions.test_version(test_id)
+    if paper is None or paper.version != version:
+        paper = _load_paper(test_id, version)
+        if paper is None:
+            _papers.pop(test_id)
+        else:
+            _papers.put(test_id, paper)
+    return paper
+
+
+def get_student_paper(test, username):
+    """`test` is a registry.PublishedTest. Fixed-paper tests share one cached
+    paper; pool tests draw from the cached bank without touching SQLite."""
+    paper = get_paper(test.test_id)
+    if paper is not None and test.pool_size:
+        return paper.draw(username, test.total_qs)
+    return paper
+
+
+def invalidate(test_id=None):
+    if test_id is None:
+        _papers.clear()
+    else:
+        _papers.pop(int(test_id))
+
+
+def invalidate_question(qid):
+    for paper in _papers.values():
+        if qid in paper.answers:
+            _papers.pop(paper.test_id)
+
+
+def _reset_after_fork():
+    _papers.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import metrics
+from database import get_db
+
+# Other worker processes publish tests too; they cannot invalidate us, so
+# the registry also reloads itself after this many seconds.
+REFRESH_SECONDS = 30
+
+class PublishedTest(namedtuple('PublishedTest', 'test_id category total_qs start end duration pool_size')):
+    __slots__ = ()
+
+    def is_open(self, now=None):
+        # Same window the student dashboard shows; malformed dates never open.
+        if self.start is None or self.end is None:
+            return False
+        now = now or datetime.now()
+        return self.start <= now <= self.end
+
+    @property
+    def submissions_close(self):
+        # A student who starts just before the end still gets the full timer.
+        return self.end + timedelta(minutes=self.duration or 30) if self.end else None
+
+    def accepts_submissions(self, now=None):
+        if self.start is None or self.end is None:
+            return False
+        return self.start <= (now or datetime.now()) <= self.submissions_close
+
+_lock = threading.Lock()
+_tests = None          # {category: PublishedTest}
+_loaded_at = 0.0
+_hits = 0
+_misses = 0
+metrics.register_cache('published_tests', lambda: (_hits, _misses))
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def _load():
+    cur = get_db().execute('''
+        SELECT id, category, total_qs, start_date, end_date, duration, pool_size
+        FROM tests
+        WHERE id IN (SELECT MAX(id) FROM tests WHERE published = 1 GROUP BY category)
+    ''')
+    return {
+        category: PublishedTest(test_id, category, total_qs,
+                                parse_date(start_date), parse_date(end_date), duration, pool_size)
+        for test_id, category, total_qs, start_date, end_date, duration, pool_size in cur.fetchall()
+    }
+
+
+def get_published_tests():
+    """Latest published test per category, served from memory."""
+    global _tests, _loaded_at, _hits, _misses
+    tests = _tests
+    if tests is not None and time.monotonic() - _loaded_at < REFRESH_SECONDS:
+        _hits += 1
+        return tests
+
+    with _lock:
+        if _tests is None or time.monotonic() - _loaded_at >= REFRESH_SECONDS:
+            _misses += 1
+            _tests = _load()
+            _loaded_at = time.monotonic()
+        else:
+            _hits += 1
+        return _tests
+
+
+def get_published_test(category):
+    return get_published_tests().get(category)
+
+
+def invalidate():
+    global _tests
+    with _lock:
+        _tests = None
+
+
+def _reset_after_fork():
+    # The loaded tests are kept; a parent thread may have held the lock.
+    global _lock, _hits, _misses
+    _lock = threading.Lock()
+    _hits = _misses = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
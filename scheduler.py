@@ -0,0 +1,141 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+
+import autosave
+import metrics
+import models
+import registry
+
+# How often the schedule is rebuilt from the tests table, so tests published
+# by other processes get their boundaries scheduled too.
+REPLAN_SECONDS = 60
+# Wait after submissions close before finalizing a test, so autosave deltas
+# still buffered in web workers (flushed every autosave.FLUSH_INTERVAL) land first.
+CLOSE_GRACE_SECONDS = 10
+
+JOBS_RUN = metrics.Counter('portal_scheduler_jobs_total', "Scheduled jobs run.", labelnames=('job', 'status'))
+
+
+class Scheduler(threading.Thread):
+    """Runs jobs at wall-clock times from a heap. Jobs run one at a time on
+    this thread; a failing job is logged and does not stop the others."""
+
+    def __init__(self):
+        super().__init__(name='scheduler', daemon=True)
+        self._heap = []             # [(when, seq, name, fn, args)]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._planned = set()       # (name, test_id) already on the heap
+
+    def schedule(self, when, name, fn, *args):
+        """Run fn(*args) at `when` (a datetime or epoch seconds)."""
+        if isinstance(when, datetime):
+            when = when.timestamp()
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._seq), name, fn, args))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return [(datetime.fromtimestamp(when), name, args) for when, _, name, _, args in sorted(self._heap)]
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self.join(timeout)
+
+    def run(self):
+        self.schedule(time.time(), 'plan', self.plan)
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    delay = self._heap[0][0] - time.time() if self._heap else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopping:
+                    return
+                _, _, name, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+                JOBS_RUN.inc(job=name, status='ok')
+            except Exception as e:
+                JOBS_RUN.inc(job=name, status='error')
+                print(f"⚠️ Scheduled job {name}{args} failed: {e}")
+
+    # ========== TEST LIFECYCLE ==========
+    def plan(self):
+        now = datetime.now()
+        for test in models.get_unclosed_tests():
+            if test.start is None or test.end is None:
+                continue
+            if test.start > now and ('open', test.test_id) not in self._planned:
+                self._planned.add(('open', test.test_id))
+                self.schedule(test.start, 'open', self.open_test, test)
+            if ('close', test.test_id) not in self._planned:
+                self._planned.add(('close', test.test_id))
+                self.schedule(max(test.submissions_close, now).timestamp() + CLOSE_GRACE_SECONDS,
+                              'close', self.close_test, test)
+        self.schedule(time.time() + REPLAN_SECONDS, 'plan', self.plan)
+
+    def open_test(self, test):
+        self._planned.discard(('open', test.test_id))
+        registry.invalidate()
+        print(f"✅ Test {test.test_id} ({test.category}) is open.")
+
+    def close_test(self, test):
+        self._planned.discard(('close', test.test_id))
+        # Dates may have changed since this was scheduled; plan() picks it up again.
+        current = next((t for t in models.get_unclosed_tests() if t.test_id == test.test_id), None)
+        if current is None or current.end is None or current.submissions_close > datetime.now():
+            return
+        registry.invalidate()
+        autosave.flush()
+        finalized = models.finalize_drafts(current)
+        summary = models.compute_test_summary(current.test_id)
+        models.mark_test_closed(current.test_id)
+        print(f"✅ Test {current.test_id} ({current.category}) closed: "
+              f"{finalized} unsubmitted drafts graded, {summary[1]} attempts summarized.")
+
+
+_scheduler = None
+_scheduler_pid = None
+_lock = threading.Lock()
+
+
+def start():
+    """Run the scheduler on a background thread of this process."""
+    global _scheduler, _scheduler_pid
+    with _lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = Scheduler()
+            _scheduler.start()
+            _scheduler_pid = os.getpid()
+    return _scheduler
+
+
+def run_forever():
+    """Run the scheduler in the foreground until interrupted."""
+    scheduler = start()
+    try:
+        while scheduler.is_alive():
+            scheduler.join(1)
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+def _reset_after_fork():
+    # The parent's scheduler thread does not exist in the child.
+    global _lock, _scheduler
+    _lock = threading.Lock()
+    _scheduler = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,235 @@
+"""Production server: a master process that preloads the app and forks
+worker processes, each serving requests from a fixed pool of threads.
+
+    python serve.py --port 8000 --workers 4 --threads 16
+
+With --scheduler (or RUN_SCHEDULER=1) the test lifecycle scheduler runs in
+a child process of its own, so the master never has threads of its own
+when it forks.
+
+Signals to the master:
+    SIGTERM / SIGINT   finish in-flight requests, then exit
+    SIGHUP             reload cached data and the asset manifest, then
+                       replace the workers one generation at a time
+                       (restart the master for new code)
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import assets
+import autosave
+import database
+import metrics
+import papers
+import registry
+import scheduler
+import writer
+
+# Seconds a stopping worker gets to finish its in-flight requests.
+GRACEFUL_TIMEOUT = 30
+
+
+class QuietHandler(WSGIRequestHandler):
+    # Per-request logging goes through /metrics instead.
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's server with requests handled by a fixed thread pool, so
+    concurrency per worker (and SQLite connections) stays bounded."""
+
+    def __init__(self, app, fd, threads):
+        super().__init__('0.0.0.0', 0, app, handler=QuietHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+# ========== MASTER ==========
+def warm(app):
+    """Compile every template and load the published tests and their papers
+    so forked workers start with them already in (shared) memory."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.test_request_context():
+        for test in registry.get_published_tests().values():
+            paper = papers.get_paper(test.test_id)
+            if paper and not test.pool_size:
+                paper.render()
+    # Children must open their own SQLite handles.
+    database.reset_pool()
+
+
+def spawn(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def stop_workers(pids, timeout=GRACEFUL_TIMEOUT):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    remaining.discard(pid)
+            except ChildProcessError:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def serve(host='0.0.0.0', port=8000, workers=None, threads=16, backlog=1024, config=None):
+    from app import create_app
+
+    config = dict(config or {})
+    run_scheduler = config.pop('RUN_SCHEDULER', os.environ.get('RUN_SCHEDULER') == '1')
+    # Never as a thread of the master: it is started below in its own child.
+    app = create_app(dict(config, RUN_SCHEDULER=False))
+    with app.app_context():
+        if database.schema_version(database.get_db()) < database.MIGRATIONS[-1][0]:
+            raise SystemExit("❌ Database schema is out of date: run `flask --app app init-db` or pass --init-db.")
+    workers = workers or os.cpu_count() or 1
+    # Each request thread holds one pooled connection for its request.
+    database.configure_pool(threads)
+
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.set_inheritable(True)
+
+    warm(app)
+    # Every child writes its metrics here so any worker can answer /metrics for all.
+    metrics_dir = tempfile.mkdtemp(prefix='portal-metrics-')
+    pids = {spawn(run_worker, app, listener, threads, metrics_dir) for _ in range(workers)}
+    scheduler_pid = spawn(run_scheduler_process, metrics_dir) if run_scheduler else None
+    print(f"🚀 Serving on http://{host}:{port} with {workers} workers x {threads} threads (master {os.getpid()})")
+
+    signals = []
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, lambda signum, frame: signals.append(signum))
+
+    while True:
+        while signals:
+            signum = signals.pop(0)
+            if signum == signal.SIGHUP:
+                print("🔄 Reloading workers")
+                registry.invalidate()
+                papers.invalidate()
+                assets.load_manifest(app)
+                warm(app)
+                old, pids = pids, {spawn(run_worker, app, listener, threads, metrics_dir) for _ in range(workers)}
+                stop_workers(old)
+                if scheduler_pid:
+                    # Stopped first: two schedulers would close the same tests.
+                    stop_workers([scheduler_pid])
+                    scheduler_pid = spawn(run_scheduler_process, metrics_dir)
+            else:
+                print("🛑 Shutting down")
+                stop_workers(pids | ({scheduler_pid} if scheduler_pid else set()))
+                listener.close()
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+                return
+
+        # Replace workers that died on their own.
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in pids:
+            pids.discard(pid)
+            print(f"⚠️ Worker {pid} exited with status {status}, restarting")
+            pids.add(spawn(run_worker, app, listener, threads, metrics_dir))
+        elif pid and pid == scheduler_pid:
+            print(f"⚠️ Scheduler {pid} exited with status {status}, restarting")
+            scheduler_pid = spawn(run_scheduler_process, metrics_dir)
+        time.sleep(0.2)
+
+
+# ========== WORKER ==========
+def run_worker(app, listener, threads, metrics_dir):
+    for sig in (signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_IGN)
+    metrics.share(metrics_dir)
+
+    server = PooledWSGIServer(app, listener.fileno(), threads)
+    # shutdown() blocks until serve_forever returns, so call it off the main thread.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    server.serve_forever()
+    server.executor.shutdown(wait=True)
+    # os._exit skips atexit: flush buffered autosaves and drain the writer here.
+    autosave.flush()
+    writer.shutdown()
+    # Its counts stay in the totals after it exits.
+    metrics.publish()
+
+
+def run_scheduler_process(metrics_dir):
+    for sig in (signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_IGN)
+    metrics.share(metrics_dir)
+    worker = scheduler.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=worker.stop).start())
+    while worker.is_alive():
+        worker.join(1)
+    autosave.flush()
+    writer.shutdown()
+    metrics.publish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the portal with preforked workers.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument('--threads', type=int, default=16, help="Request threads per worker.")
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--database', help="SQLite file to serve (default: $DATABASE or database.db).")
+    parser.add_argument('--init-db', action='store_true', help="Create or upgrade the schema before forking.")
+    parser.add_argument('--scheduler', action='store_true',
+                        help="Also run the test lifecycle scheduler (default: $RUN_SCHEDULER).")
+    args = parser.parse_args(argv)
+
+    config = {'INIT_DB': args.init_db}
+    if args.scheduler:
+        config['RUN_SCHEDULER'] = True
+    if args.database:
+        config['DATABASE'] = args.database
+    serve(args.host, args.port, args.workers, args.threads, args.backlog, config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Near-duplicate question detection with MinHash and LSH.
+
+Each question is reduced to the set of 5-byte shingles of its normalized
+text and summarized by a MinHash signature of NUM_PERM values; the share of
+equal values between two signatures estimates the Jaccard similarity of the
+shingle sets. Signatures are split into BANDS bands of ROWS values and every
+band is hashed to a bucket in question_lsh, so finding candidates is a few
+index lookups per database however large the bank grows. Candidates are then
+checked against THRESHOLD using their stored signatures.
+
+Index rows live next to the questions they describe (in the same shard) and
+are written in the same transaction.
+"""
+import hashlib
+import json
+import re
+
+import numpy as np
+
+import storage
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_BYTES = 5
+# Estimated Jaccard similarity at which two questions are flagged. With 16
+# bands of 4 rows pairs at 0.6 become candidates ~90% of the time and pairs
+# at 0.7 ~99%; below ~0.5 most pairs are never compared. Set through the
+# app's SIMILARITY_THRESHOLD config.
+THRESHOLD = 0.6
+# Most matches listed per question.
+MAX_MATCHES = 5
+
+# Fixed seeds so signatures stay comparable across processes and releases.
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+_WEIGHTS = np.array([1 << (8 * i) for i in range(SHINGLE_BYTES)], dtype=np.uint64)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+# ========== SIGNATURES ==========
+def normalize(text):
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def signature(text):
+    """MinHash signature (NUM_PERM uint32 values) of a question's text."""
+    data = np.frombuffer(normalize(text).encode('utf-8'), dtype=np.uint8)
+    if len(data) < SHINGLE_BYTES:
+        data = np.concatenate([data, np.zeros(SHINGLE_BYTES - len(data), dtype=np.uint8)])
+    # Each 5-byte window read as a 40-bit integer is its own (exact) shingle id.
+    windows = np.lib.stride_tricks.sliding_window_view(data, SHINGLE_BYTES).astype(np.uint64)
+    shingles = np.unique(windows @ _WEIGHTS)
+    # Multiply-shift hashing; uint64 arithmetic wraps around as intended.
+    hashed = (_A[:, None] * shingles[None, :] + _B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def buckets(sig):
+    """One LSH bucket per band, as signed 64-bit integers."""
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                 digest_size=8, person=band.to_bytes(2, 'big')).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def estimate(sig, other):
+    return float(np.count_nonzero(sig == other)) / NUM_PERM
+
+
+def _decode(blob):
+    return np.frombuffer(blob, dtype='<u4')
+
+
+# ========== INDEX ==========
+def index_question(conn, qid, text, sig=None):
+    """(Re)index one question. Runs inside the caller's transaction on the
+    connection that wrote the question."""
+    sig = signature(text) if sig is None else sig
+    conn.execute("DELETE FROM question_lsh WHERE question_id = ?", (qid,))
+    conn.execute("INSERT OR REPLACE INTO question_signatures (question_id, signature) VALUES (?, ?)",
+                 (qid, sig.astype('<u4').tobytes()))
+    conn.executemany("INSERT OR IGNORE INTO question_lsh (bucket, question_id) VALUES (?, ?)",
+                     [(bucket, qid) for bucket in buckets(sig)])
+
+
+def index_all(conn, batch=1000):
+    """Index every question of one database that has no signature yet."""
+    cur = conn.execute('''
+        SELECT id, question FROM questions
+        WHERE id NOT IN (SELECT question_id FROM question_signatures)
+    ''')
+    indexed = 0
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return indexed
+        for qid, text in rows:
+            index_question(conn, qid, text or '')
+        indexed += len(rows)
+
+
+def find_similar(text=None, sig=None, threshold=None, exclude=(), limit=MAX_MATCHES):
+    """Questions anywhere in the bank whose estimated similarity to `text`
+    (or to the signature `sig`) is at least `threshold`, most similar first,
+    as dicts with id, test_id, question and similarity."""
+    sig = signature(text) if sig is None else sig
+    threshold = THRESHOLD if threshold is None else threshold
+    keys = json.dumps(buckets(sig))
+    matches = []
+    for shard in storage.shards():
+        cur = shard.get_db().execute('''
+            SELECT q.id, q.test_id, q.question, s.signature
+            FROM question_signatures s JOIN questions q ON q.id = s.question_id
+            WHERE s.question_id IN (
+                SELECT question_id FROM question_lsh WHERE bucket IN (SELECT value FROM json_each(?))
+            )
+        ''', (keys,))
+        for qid, test_id, question, blob in cur.fetchall():
+            if qid in exclude:
+                continue
+            similarity = estimate(sig, _decode(blob))
+            if similarity >= threshold:
+                matches.append({'id': qid, 'test_id': test_id, 'question': question,
+                                'similarity': round(similarity, 2)})
+    matches.sort(key=lambda m: (-m['similarity'], m['id']))
+    return matches[:limit]
+
+
+def signatures_for_test(test_id):
+    """[(question id, question, signature)] of one test, in upload order."""
+    cur = storage.for_test(test_id).get_db().execute('''
+        SELECT q.id, q.question, s.signature
+        FROM questions q JOIN question_signatures s ON s.question_id = q.id
+        WHERE q.test_id = ? ORDER BY q.id
+    ''', (test_id,))
+    return [(qid, question, _decode(blob)) for qid, question, blob in cur.fetchall()]
+
+
+class BatchIndex:
+    """In-memory LSH over the questions of one import file, so rewordings
+    within the file are caught before any of it is written."""
+
+    def __init__(self):
+        self._buckets = {}      # {bucket: [(key, signature)]}
+
+    def find(self, sig, threshold=None):
+        threshold = THRESHOLD if threshold is None else threshold
+        seen, matches = set(), []
+        for bucket in buckets(sig):
+            for key, other in self._buckets.get(bucket, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                similarity = estimate(sig, other)
+                if similarity >= threshold:
+                    matches.append((similarity, key))
+        return sorted(matches, reverse=True)
+
+    def add(self, key, sig):
+        for bucket in buckets(sig):
+            self._buckets.setdefault(bucket, []).append((key, sig))
+
+
+def configure(threshold=THRESHOLD):
+    global THRESHOLD
+    THRESHOLD = threshold
+
+
+def init_app(app):
+    configure(app.config['SIMILARITY_THRESHOLD'])
@@ -0,0 +1,176 @@
+"""Read-only snapshots for analytics.
+
+Reporting queries (attempt counts, item analysis) read a copy of the
+tables they need (SNAPSHOT_TABLES) instead of the live file, so however long
+they run they never hold read locks, pages or checkpoints that exam
+submissions are waiting on. Copies are taken on a background thread, never
+by the request that finds one stale: it reads the stale copy (or, before the
+first copy exists, the live database) while the new one is taken.
+
+Snapshots live in memory, one per database and process, or in
+ANALYTICS_SNAPSHOT_DIR as files shared by every worker process: whichever
+process finds the file stale retakes it and atomically replaces it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Seconds a snapshot may lag behind the live database; 0 reads the live
+# database directly. Set through the app's ANALYTICS_MAX_STALENESS config.
+MAX_STALENESS = 60
+# Directory for shared snapshot files; None keeps them in memory.
+SNAPSHOT_DIR = None
+# What reporting reads; everything else (questions, search and similarity
+# indexes, drafts) is left out of the copy.
+SNAPSHOT_TABLES = ('attempts',)
+
+REFRESHES = metrics.Counter('portal_snapshot_refreshes_total', "Analytics snapshots taken.", ('database',))
+REFRESH_SECONDS = metrics.Histogram('portal_snapshot_refresh_seconds', "Time spent taking an analytics snapshot.",
+                                    ('database',))
+
+_snapshots = {}     # {database name: _Snapshot}
+_lock = threading.Lock()
+
+
+class _Snapshot:
+    def __init__(self, shard):
+        self.shard = shard
+        self.label = shard.name or 'main'
+        self.path = os.path.join(SNAPSHOT_DIR, f"{self.label}.snapshot.db") if SNAPSHOT_DIR else None
+        self.conn = None
+        self.taken = 0.0        # when self.conn's copy was taken (epoch seconds)
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def get_db(self, max_staleness):
+        """The current copy, or None before the first; a stale one is retaken
+        in the background."""
+        with self.lock:
+            if self.path is not None and time.time() - self.taken > max_staleness:
+                # Cheap: another worker may have retaken the file already.
+                self._open_shared()
+            if time.time() - self.taken > max_staleness and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self._refresh, name=f"snapshot-{self.label}", daemon=True).start()
+            return self.conn
+
+    def _refresh(self):
+        try:
+            if self.path is None:
+                self._take_in_memory()
+            else:
+                self._take_shared()
+        except (sqlite3.Error, OSError) as e:
+            # Left stale; the next read tries again.
+            print(f"⚠️ Could not snapshot {self.label}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _copy(self, target):
+        started = time.perf_counter()
+        source = self.shard.connect()
+        try:
+            # One read transaction, so the tables agree: in WAL mode it never
+            # blocks writers. Rowids are kept, analytics reads new rows by them.
+            source.execute("BEGIN")
+            schema = source.execute(
+                "SELECT type, sql FROM sqlite_master WHERE tbl_name IN (SELECT value FROM json_each(?)) AND sql IS NOT NULL",
+                (json.dumps(SNAPSHOT_TABLES),)
+            ).fetchall()
+            for kind, sql in schema:
+                if kind == 'table':
+                    target.execute(sql)
+            for table in SNAPSHOT_TABLES:
+                cur = source.execute(f"SELECT rowid, * FROM {table}")
+                columns = ', '.join(['rowid'] + [c[0] for c in cur.description[1:]])
+                marks = ', '.join('?' * len(cur.description))
+                target.executemany(f"INSERT INTO {table} ({columns}) VALUES ({marks})", cur)
+            # Indexes last: building them once is cheaper than row by row.
+            for kind, sql in schema:
+                if kind == 'index':
+                    target.execute(sql)
+            target.commit()
+        finally:
+            source.close()
+        REFRESHES.inc(database=self.label)
+        REFRESH_SECONDS.observe(time.perf_counter() - started, database=self.label)
+
+    def _take_in_memory(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False, factory=metrics.InstrumentedConnection)
+        self._copy(conn)
+        # Threads still reading the previous copy keep it alive until they finish.
+        with self.lock:
+            self.conn, self.taken = conn, time.time()
+
+    def _open_shared(self):
+        try:
+            taken = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if taken > self.taken:
+            self.conn = _open_read_only(self.path)
+            self.taken = taken
+
+    def _take_shared(self):
+        partial = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        target = sqlite3.connect(partial)
+        try:
+            self._copy(target)
+        finally:
+            target.close()
+        os.replace(partial, self.path)
+        with self.lock:
+            self._open_shared()
+
+
+def _open_read_only(path):
+    # immutable: the file is never written in place, only replaced, so
+    # SQLite can skip locking entirely.
+    return sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False,
+                           factory=metrics.InstrumentedConnection)
+
+
+def configure(max_staleness=MAX_STALENESS, snapshot_dir=None):
+    global MAX_STALENESS, SNAPSHOT_DIR
+    with _lock:
+        MAX_STALENESS = max_staleness
+        SNAPSHOT_DIR = snapshot_dir
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+        _snapshots.clear()
+
+
+def init_app(app):
+    configure(app.config['ANALYTICS_MAX_STALENESS'], app.config['ANALYTICS_SNAPSHOT_DIR'])
+
+
+def get_db(shard):
+    """A read-only connection to a recent copy of SNAPSHOT_TABLES of `shard`
+    (a storage shard or storage.MAIN), normally at most MAX_STALENESS seconds
+    old plus the time a copy takes. Until the first copy is ready this is the
+    live connection. The connection is shared between threads: run queries
+    on it, never transactions."""
+    if not MAX_STALENESS:
+        return shard.get_db()
+    with _lock:
+        snapshot = _snapshots.get(shard.name)
+        if snapshot is None or snapshot.shard is not shard:
+            snapshot = _snapshots[shard.name] = _Snapshot(shard)
+    conn = snapshot.get_db(MAX_STALENESS)
+    return conn if conn is not None else shard.get_db()
+
+
+def _reset_after_fork():
+    # Locks may have been held by parent threads at fork time.
+    global _lock
+    _lock = threading.Lock()
+    _snapshots.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,11 @@
+// Slide + fade out alerts after 4 seconds
+window.setTimeout(function () {
+  const alerts = document.querySelectorAll('.alert');
+  alerts.forEach(function (alert) {
+    alert.classList.add('slide-fade-out');
+    setTimeout(() => {
+      let fade = new bootstrap.Alert(alert);
+      fade.close();
+    }, 600); // match the CSS transition time
+  });
+}, 4000);
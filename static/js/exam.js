@@ -0,0 +1,65 @@
+// Page data comes from data- attributes on the form, so this file is the
+// same for every exam and can be cached.
+const form = document.getElementById('exam-form');
+const timerDisplay = document.getElementById('timer');
+const progressBar = document.getElementById('progress-bar');
+
+// Timer Logic: the test's duration in minutes
+const durationSeconds = parseInt(form.dataset.duration, 10) * 60;
+let totalSeconds = durationSeconds;
+
+function updateTimer() {
+    const minutes = Math.floor(totalSeconds / 60);
+    const seconds = totalSeconds % 60;
+    timerDisplay.textContent = `⏳ Time Remaining: ${minutes}:${seconds < 10 ? '0' : ''}${seconds}`;
+
+    const progress = ((1 - (totalSeconds / durationSeconds)) * 100).toFixed(0);
+    progressBar.style.width = progress + '%';
+    progressBar.textContent = progress + '%';
+
+    if (totalSeconds <= 0) {
+        clearInterval(timerInterval);
+        alert("⏰ Time's up! Submitting your exam.");
+        // Answers are already autosaved, so spread the final submits
+        // over a few seconds instead of the whole class at once.
+        sendAutosave();
+        setTimeout(() => form.submit(), Math.random() * 5000);
+    } else {
+        totalSeconds--;
+    }
+}
+
+const timerInterval = setInterval(updateTimer, 1000);
+updateTimer();
+
+// Autosave: restore saved answers, then send only what changed
+const savedAnswers = JSON.parse(form.dataset.savedAnswers);
+const autosaveUrl = form.dataset.autosaveUrl;
+let pendingAnswers = {};
+let autosaveTimer = null;
+
+for (const [qid, answer] of Object.entries(savedAnswers)) {
+    form.querySelectorAll(`input[name="q${qid}"]`).forEach(input => {
+        if (input.value === answer) input.checked = true;
+    });
+}
+
+function sendAutosave() {
+    clearTimeout(autosaveTimer);
+    if (Object.keys(pendingAnswers).length === 0) return;
+    const body = JSON.stringify({answers: pendingAnswers});
+    pendingAnswers = {};
+    fetch(autosaveUrl, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: body, keepalive: true})
+        .catch(() => {
+            // Keep the delta for the next attempt unless newer answers replaced it
+            pendingAnswers = Object.assign(JSON.parse(body).answers, pendingAnswers);
+        });
+}
+
+form.addEventListener('change', (event) => {
+    const input = event.target;
+    if (input.type !== 'radio' || !input.name.startsWith('q')) return;
+    pendingAnswers[input.name.slice(1)] = input.value;
+    clearTimeout(autosaveTimer);
+    autosaveTimer = setTimeout(sendAutosave, 1500);
+});
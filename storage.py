@@ -0,0 +1,267 @@
+"""Routes exam data to SQLite shards.
+
+Users, the test catalog and result summaries always live in the main
+database. Questions, attempts and autosaved drafts of a test live in the
+shard its category mapped to when the test was created (recorded in
+tests.shard), so exams in different departments write to different files
+through different writer threads and never wait on each other's locks.
+
+With no SHARDS configured everything stays in the main database.
+"""
+import json
+import os
+import queue
+import threading
+
+from flask import g, has_app_context
+
+import database
+import snapshot as _snapshot
+import writer
+
+# Question ids of shard N start at N << QUESTION_ID_BITS, so an id alone
+# says which shard holds the question. The main database is shard 0.
+QUESTION_ID_BITS = 32
+
+
+class Shard:
+    """One SQLite database holding questions, attempts and drafts, with its
+    own connection pool and writer thread."""
+
+    def __init__(self, name, number, path):
+        self.name = name
+        self.number = number
+        self.path = path
+        self._target = database.resolve(path)
+        self._pool = queue.LifoQueue(maxsize=database.POOL_SIZE)
+        self._local = threading.local()
+        self._anchor = self.connect() if path == ':memory:' else None
+
+    def __repr__(self):
+        return f"Shard({self.name!r}, {self.path!r})"
+
+    def connect(self):
+        return database.connect(self._target)
+
+    def get_db(self):
+        """Like database.get_db(): bound to the request, or to the thread."""
+        if has_app_context():
+            conns = g.setdefault('shard_dbs', {})
+            if self.name not in conns:
+                try:
+                    conns[self.name] = self._pool.get_nowait()
+                except queue.Empty:
+                    conns[self.name] = self.connect()
+            return conns[self.name]
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def write(self, job, timeout=writer.SUBMIT_TIMEOUT):
+        return writer.write(job, timeout=timeout, shard=self)
+
+    def close(self):
+        writer.stop(self)
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._anchor is not None:
+            self._anchor.close()
+
+    def reset_after_fork(self):
+        self._pool = queue.LifoQueue(maxsize=database.POOL_SIZE)
+        self._local = threading.local()
+
+
+class _MainDatabase:
+    """The main database seen through the Shard interface."""
+    name = None
+    number = 0
+
+    def __repr__(self):
+        return "Shard(main)"
+
+    def connect(self):
+        return database.connect()
+
+    def get_db(self):
+        return database.get_db()
+
+    def write(self, job, timeout=writer.SUBMIT_TIMEOUT):
+        return writer.write(job, timeout=timeout)
+
+
+MAIN = _MainDatabase()
+
+_config = ({}, {})      # (shards, categories) as passed to configure()
+_shards = None          # {name: Shard}, built on first use
+_by_number = {0: MAIN}
+_categories = {}        # {category: shard name}
+_test_shards = {}       # {test_id: shard name or None}, tests never move
+_lock = threading.Lock()
+
+
+# ========== CONFIGURATION ==========
+def parse_mapping(value):
+    """'a=x,b=y' (as found in environment variables) -> {'a': 'x', 'b': 'y'}."""
+    return dict(item.split('=', 1) for item in (value or '').split(',') if '=' in item)
+
+
+def configure(shards=None, categories=None):
+    """Use the given {shard name: database path} shards. Categories are
+    routed by `categories` ({category: shard name}); a category with no
+    entry there goes to the shard of the same name, if any, else to the
+    main database. Shards are opened on first use, once the main database
+    (which numbers them) has been migrated."""
+    global _config, _shards
+    shards = dict(shards or {})
+    categories = dict(categories or {})
+    unknown = set(categories.values()) - set(shards)
+    if unknown:
+        raise ValueError(f"Categories routed to unknown shards: {', '.join(sorted(unknown))}")
+
+    with _lock:
+        for shard in (_shards or {}).values():
+            shard.close()
+        _config, _shards = (shards, categories), None
+        _test_shards.clear()
+
+
+def _loaded():
+    global _shards, _by_number, _categories
+    if _shards is None:
+        with _lock:
+            if _shards is None:
+                shards, categories = _config
+                numbers = _shard_numbers(shards) if shards else {}
+                loaded = {name: Shard(name, numbers[name], path) for name, path in shards.items()}
+                _by_number = {0: MAIN, **{shard.number: shard for shard in loaded.values()}}
+                _categories = {**{name: name for name in shards}, **categories}
+                _shards = loaded
+    return _shards
+
+
+def init_app(app):
+    configure(app.config.get('SHARDS'), app.config.get('SHARD_CATEGORIES'))
+    app.teardown_appcontext(_release_shard_dbs)
+
+
+def _release_shard_dbs(exc=None):
+    for name, conn in g.pop('shard_dbs', {}).items():
+        shard = (_shards or {}).get(name)
+        if shard is not None:
+            shard.release(conn)
+        else:
+            conn.close()
+
+
+def _shard_numbers(shards):
+    # Numbers are assigned once per shard name and kept in the main
+    # database, since they are baked into question ids.
+    conn = database.connect()
+    try:
+        with conn:
+            for name in shards:
+                conn.execute('''
+                    INSERT OR IGNORE INTO shards (name, number)
+                    VALUES (?, (SELECT COALESCE(MAX(number), 0) + 1 FROM shards))
+                ''', (name,))
+        return dict(conn.execute("SELECT name, number FROM shards").fetchall())
+    finally:
+        conn.close()
+
+
+def migrate(verbose=False):
+    """Bring every shard up to the latest schema. Shards get the same schema
+    as the main database; only their questions, attempts and drafts are used."""
+    for shard in _loaded().values():
+        conn = shard.connect()
+        try:
+            applied = database.migrate(conn)
+            first_id = shard.number << QUESTION_ID_BITS
+            with conn:
+                if conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'questions'").fetchone():
+                    conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'questions'", (first_id,))
+                else:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('questions', ?)", (first_id,))
+            if verbose and applied:
+                print(f"✅ Shard {shard.name}: applied migrations {', '.join(map(str, applied))}")
+        finally:
+            conn.close()
+
+
+# ========== ROUTING ==========
+def shards():
+    """Every database that can hold exam data, the main one first."""
+    return [MAIN, *_loaded().values()]
+
+
+def shard_name_for_category(category):
+    """Where a new test in `category` goes (None: the main database)."""
+    _loaded()
+    return _categories.get(category)
+
+
+def for_name(name):
+    return _loaded()[name] if name is not None else MAIN
+
+
+def for_test(test_id):
+    if test_id not in _test_shards:
+        row = database.get_db().execute("SELECT shard FROM tests WHERE id = ?", (test_id,)).fetchone()
+        if row is None:
+            return MAIN
+        with _lock:
+            _test_shards[test_id] = row[0]
+    return for_name(_test_shards[test_id])
+
+
+def for_question(qid):
+    _loaded()
+    return _by_number.get(qid >> QUESTION_ID_BITS, MAIN)
+
+
+def group_tests(test_ids):
+    """{shard: [test ids]} for the given tests."""
+    groups = {}
+    for test_id in test_ids:
+        groups.setdefault(for_test(test_id), []).append(test_id)
+    return groups
+
+
+def count_by_test(table, test_ids, snapshot=False):
+    """{test_id: row count of `table`} across shards, one grouped query per
+    shard; with `snapshot`, counted on the analytics snapshots."""
+    counts = {}
+    for shard, ids in group_tests(test_ids).items():
+        conn = _snapshot.get_db(shard) if snapshot else shard.get_db()
+        cur = conn.execute(f'''
+            SELECT test_id, COUNT(*) FROM {table}
+            WHERE test_id IN (SELECT value FROM json_each(?))
+            GROUP BY test_id
+        ''', (json.dumps(ids),))
+        counts.update(cur.fetchall())
+    return counts
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    for shard in (_shards or {}).values():
+        shard.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
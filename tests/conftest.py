@@ -0,0 +1,21 @@
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # One database per process, see create_app(). Tests of the 'physics'
+    # category live in a shard of their own, everything else in the main one.
+    root = tmp_path_factory.mktemp('portal')
+    return create_app({
+        'DATABASE': str(root / 'portal.db'),
+        'SHARDS': {'physics': str(root / 'physics.db')},
+        'INIT_DB': True,
+    })
+
+
+@pytest.fixture
+def portal(app):
+    with app.app_context():
+        yield app
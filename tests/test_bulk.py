@@ -0,0 +1,28 @@
+import io
+import json
+
+import bulk
+from models import create_test, get_question_count_for_test, get_test_by_id
+
+
+def _questions_file(count):
+    items = [{'question': f"What is {i} + 1?", 'options': [str(i + 1), 'x', 'y'], 'answer': str(i + 1)}
+             for i in range(count)]
+    return io.BytesIO(json.dumps(items).encode())
+
+
+def test_import_rejects_more_questions_than_the_test_needs(portal):
+    test_id = create_test('aptitude', 2, 10, '2020-01-01', '2030-01-01', 'prof')
+
+    report = bulk.import_questions(test_id, bulk.read_questions(_questions_file(5), 'questions.json'))
+
+    assert report.inserted == 0
+    assert not report.published
+    assert len(report.errors) == 1 and "needs 2 more" in report.errors[0]['error']
+    assert get_question_count_for_test(test_id) == 0
+    assert get_test_by_id(test_id)[6] == 0
+
+    report = bulk.import_questions(test_id, bulk.read_questions(_questions_file(2), 'questions.json'))
+
+    assert report.inserted == 2 and report.published
+    assert get_question_count_for_test(test_id) == 2
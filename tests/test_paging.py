@@ -0,0 +1,60 @@
+import storage
+from models import (add_question_to_test, create_test, encode_cursor, get_student_attempts,
+                    search_questions)
+
+
+def _walk(fetch, limit):
+    rows, cursor = fetch(limit, None)
+    pages = [rows]
+    while cursor:
+        rows, cursor = fetch(limit, cursor)
+        pages.append(rows)
+    return pages
+
+
+def _add_attempt(test_id, username, category, timestamp):
+    def insert(conn):
+        conn.execute(
+            "INSERT INTO attempts (username, category, score, test_id, timestamp) VALUES (?, ?, 1, ?, ?)",
+            (username, category, test_id, timestamp)
+        )
+    storage.for_test(test_id).write(insert)
+
+
+def test_student_attempts_page_across_shards_with_tied_timestamps(portal):
+    # Three attempts per database, four of them at the same second.
+    timestamps = ['2024-05-01 09:00:00', '2024-05-01 09:00:00', '2024-05-02 10:00:00']
+    for category in ('physics', 'history'):
+        for timestamp in timestamps:
+            test_id = create_test(category, 1, 10, '2024-01-01', '2024-12-31', 'prof')
+            _add_attempt(test_id, 'pager', category, timestamp)
+    assert {storage.for_test(row[3]) for row in get_student_attempts('pager')[0]} == {
+        storage.MAIN, storage.for_name('physics')}
+
+    everything, cursor = get_student_attempts('pager', limit=100)
+    assert len(everything) == 6 and cursor is None
+
+    for limit in (1, 2, 4):
+        pages = _walk(lambda limit, cursor: get_student_attempts('pager', limit, cursor), limit)
+        assert all(len(page) == limit for page in pages[:-1])
+        assert [row for page in pages for row in page] == everything
+
+    # A mangled cursor starts over rather than failing.
+    first_page = get_student_attempts('pager', limit=2)
+    for cursor in ('not-base64!', encode_cursor(1, 2), encode_cursor('x', 'y', 'z'), encode_cursor('x', True, 1)):
+        assert get_student_attempts('pager', limit=2, cursor=cursor) == first_page
+
+
+def test_search_pages_across_shards(portal):
+    for category in ('physics', 'history'):
+        test_id = create_test(category, 5, 10, '2024-01-01', '2024-12-31', 'prof')
+        for i in range(5):
+            add_question_to_test(test_id, f"Which {category} pendulum swings {i} times?", ["a", "b"], "a")
+
+    everything, cursor = search_questions('pendulum', limit=100)
+    assert len(everything) == 10 and cursor is None
+    assert {storage.for_question(row[0]) for row in everything} == {storage.MAIN, storage.for_name('physics')}
+
+    for limit in (1, 3, 4):
+        pages = _walk(lambda limit, cursor: search_questions('pendulum', limit=limit, cursor=cursor), limit)
+        assert [row for page in pages for row in page] == everything
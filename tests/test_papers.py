@@ -0,0 +1,35 @@
+import re
+from datetime import date, timedelta
+
+import papers
+from models import add_question_to_test, create_test, publish_test
+
+
+def _login(client, username, role):
+    client.post('/register', data={'username': username, 'password': 'pw', 'role': role})
+    client.post('/login', data={'username': username, 'password': 'pw', 'role': role})
+
+
+def test_pool_draw_is_the_same_on_the_exam_page_and_at_grading(app):
+    start, end = date.today() - timedelta(days=1), date.today() + timedelta(days=3)
+    with app.app_context():
+        test_id = create_test('geography', 3, 10, start.isoformat(), end.isoformat(), 'prof', pool_size=6)
+        for i in range(6):
+            add_question_to_test(test_id, f"Capital number {i}?", [f"city {i}", "nowhere", "elsewhere"], f"city {i}")
+        publish_test(test_id)
+        bank = papers.get_paper(test_id)
+        expected = bank.draw('pooled', 3)
+
+    student = app.test_client()
+    _login(student, 'pooled', 'student')
+    page = student.get('/exam/geography').get_data(as_text=True)
+    shown = [int(qid) for qid in dict.fromkeys(re.findall(r'name="q(\d+)"', page))]
+    options = re.findall(r'name="q\d+" id="[^"]+" value="([^"]+)"', page)
+
+    assert shown == [q['id'] for q in expected.questions]
+    assert options == [option for q in expected.questions for option in q['options']]
+    assert bank.draw('pooled', 3).questions == expected.questions     # and so does every reload
+
+    result = student.post('/exam/geography', data={f"q{qid}": bank.answers[qid] for qid in shown})
+
+    assert 'Score: 3 / 3' in result.get_data(as_text=True)
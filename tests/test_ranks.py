@@ -0,0 +1,59 @@
+import storage
+from models import create_test, get_leaderboard, get_score_rank, get_score_ranks
+
+
+def _histogram(test_id):
+    return dict(storage.for_test(test_id).get_db().execute(
+        "SELECT score, count FROM score_histogram WHERE test_id = ? AND count > 0", (test_id,)
+    ).fetchall())
+
+
+def _write(test_id, sql, *params):
+    storage.for_test(test_id).write(lambda conn: conn.execute(sql, params))
+
+
+def _add_attempt(test_id, username, score, timestamp='2024-05-01 09:00:00'):
+    _write(test_id, "INSERT INTO attempts (username, category, score, test_id, timestamp) VALUES (?, 'ranked', ?, ?, ?)",
+           username, score, test_id, timestamp)
+
+
+def test_histogram_follows_attempts(portal):
+    for category in ('ranked', 'physics'):
+        test_id = create_test(category, 3, 10, '2024-01-01', '2024-12-31', 'prof')
+        for username, score in (('a', 3), ('b', 2), ('c', 2), ('d', 1)):
+            _add_attempt(test_id, username, score)
+        assert _histogram(test_id) == {3: 1, 2: 2, 1: 1}
+
+        _write(test_id, "UPDATE attempts SET score = 3 WHERE test_id = ? AND username = 'b'", test_id)
+        assert _histogram(test_id) == {3: 2, 2: 1, 1: 1}
+
+        _write(test_id, "DELETE FROM attempts WHERE test_id = ? AND username = 'd'", test_id)
+        assert _histogram(test_id) == {3: 2, 2: 1}
+
+
+def test_rank_and_percentile(portal):
+    test_id = create_test('ranked', 3, 10, '2024-01-01', '2024-12-31', 'prof')
+    other_id = create_test('physics', 3, 10, '2024-01-01', '2024-12-31', 'prof')
+    for username, score in (('a', 3), ('b', 2), ('c', 2), ('d', 1)):
+        _add_attempt(test_id, username, score)
+    _add_attempt(other_id, 'a', 0)
+
+    # Rank counts better scores; the percentile is the share scoring lower plus half the ties.
+    assert get_score_ranks([(test_id, 3), (test_id, 2), (test_id, 1), (other_id, 0)]) == {
+        (test_id, 3): (1, 88, 4),      # (3 + 1/2) / 4
+        (test_id, 2): (2, 50, 4),      # (1 + 2/2) / 4
+        (test_id, 1): (4, 12, 4),      # (0 + 1/2) / 4
+        (other_id, 0): (1, 50, 1),
+    }
+    assert get_score_rank(test_id, 0) == (5, 0, 4)     # a score nobody got
+    assert get_score_rank(create_test('ranked', 3, 10, '2024-01-01', '2024-12-31', 'prof'), 3) is None
+
+
+def test_leaderboard_breaks_ties_by_time(portal):
+    test_id = create_test('ranked', 3, 10, '2024-01-01', '2024-12-31', 'prof')
+    _add_attempt(test_id, 'late', 3, '2024-05-01 10:00:00')
+    _add_attempt(test_id, 'early', 3, '2024-05-01 09:00:00')
+    _add_attempt(test_id, 'low', 1, '2024-05-01 08:00:00')
+
+    assert [row[0] for row in get_leaderboard(test_id)] == ['early', 'late', 'low']
+    assert [row[0] for row in get_leaderboard(test_id, limit=1)] == ['early']
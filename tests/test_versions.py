@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import papers
+import versions
+from models import add_question_to_test, create_test, publish_test
+
+
+def _login(client, username, role):
+    client.post('/register', data={'username': username, 'password': 'pw', 'role': role})
+    client.post('/login', data={'username': username, 'password': 'pw', 'role': role})
+
+
+class _Clock:
+    now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def _refresh(client, path, tag):
+    return client.get(path, headers={'If-None-Match': tag})
+
+
+def test_unchanged_page_is_not_modified_unless_a_flash_is_pending(app):
+    student = app.test_client()
+    _login(student, 'etag', 'student')
+    # The login message is still pending: shown once, so never tagged.
+    assert 'ETag' not in student.get('/profile').headers
+
+    tag = student.get('/profile').headers['ETag']
+    assert _refresh(student, '/profile', tag).status_code == 304
+
+    student.post('/change_password', data={'old_password': 'pw', 'new_password': 'a', 'confirm_password': 'b'})
+    flashed = _refresh(student, '/profile', tag)
+    assert flashed.status_code == 200 and 'New passwords do not match.' in flashed.get_data(as_text=True)
+    assert _refresh(student, '/profile', tag).status_code == 304
+
+    student.post('/change_password', data={'old_password': 'pw', 'new_password': 'pw2', 'confirm_password': 'pw2'})
+    student.get('/student_dashboard')
+    assert _refresh(student, '/profile', tag).status_code == 200
+
+
+def test_other_submissions_change_ranks_only_once_per_window(app, monkeypatch):
+    start, end = date.today() - timedelta(days=1), date.today() + timedelta(days=3)
+    with app.app_context():
+        test_id = create_test('chemistry', 1, 10, start.isoformat(), end.isoformat(), 'prof')
+        add_question_to_test(test_id, "What is H2O?", ["water", "salt"], "water")
+        publish_test(test_id)
+        field = f"q{papers.get_paper(test_id).questions[0]['id']}"
+    monkeypatch.setattr(versions, 'time', _Clock())
+
+    first = app.test_client()
+    _login(first, 'first', 'student')
+    first.get('/exam/chemistry')
+    first.post('/exam/chemistry', data={field: 'water'})
+    tag = first.get('/result/chemistry').headers['ETag']
+    stats_tag = first.get('/stats').headers['ETag']
+
+    for name in ('second', 'third'):
+        other = app.test_client()
+        _login(other, name, 'student')
+        other.get('/exam/chemistry')
+        other.post('/exam/chemistry', data={field: 'salt'})
+        assert _refresh(first, '/result/chemistry', tag).status_code == 304
+        assert _refresh(first, '/stats', stats_tag).status_code == 304
+
+    versions.time.now += versions.RANK_STALENESS
+    page = _refresh(first, '/result/chemistry', tag)
+    assert page.status_code == 200 and page.headers['ETag'] != tag
+    assert 'Rank 1 of 3' in page.get_data(as_text=True)
+    assert _refresh(first, '/stats', stats_tag).status_code == 200
@@ -0,0 +1,64 @@
+import pytest
+
+import database
+import writer
+
+
+def _versions(conn, scope):
+    return dict(conn.execute("SELECT key, version FROM data_versions WHERE scope = ?", (scope,)).fetchall())
+
+
+def _set_version(key, fail=False):
+    def job(conn):
+        conn.execute("INSERT INTO data_versions (scope, key, version) VALUES ('test_writer', ?, 1)", (key,))
+        if fail:
+            raise ValueError(f"job {key} failed")
+        return key
+    return job
+
+
+def test_failing_job_rolls_back_only_itself(portal):
+    w = writer.Writer()
+    # Queued before the thread starts, so all three land in one batch.
+    futures = [w.submit(_set_version('a')), w.submit(_set_version('b', fail=True)), w.submit(_set_version('c'))]
+    w.start()
+    try:
+        assert futures[0].result(timeout=5) == 'a'
+        with pytest.raises(ValueError, match="job b failed"):
+            futures[1].result(timeout=5)
+        assert futures[2].result(timeout=5) == 'c'
+    finally:
+        w.stop()
+
+    assert w.batches == 1 and w.jobs_committed == 3
+    assert _versions(database.get_db(), 'test_writer') == {'a': 1, 'c': 1}
+
+
+def test_full_queue_raises_writer_busy():
+    w = writer.Writer(maxsize=1)
+    w.submit(_set_version('queued'))
+
+    with pytest.raises(writer.WriterBusy):
+        w.submit(_set_version('rejected'), timeout=0.01)
+
+
+# The writer thread is killed on purpose.
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_dead_writer_is_replaced_and_its_queue_kept(portal, monkeypatch):
+    old = writer.get_writer()
+
+    def die(conn, jobs):
+        raise SystemExit
+    monkeypatch.setattr(old, '_commit', die)
+    old.submit(lambda conn: None)
+    old.join(5)
+    assert not old.is_alive()
+
+    # Queued behind the dead thread: its replacement must pick it up.
+    pending = old.submit(_set_version('after_death'))
+    replacement = writer.get_writer()
+
+    assert replacement is not old and replacement.is_alive()
+    assert pending.result(timeout=5) == 'after_death'
+    assert writer.write(_set_version('next')) == 'next'
+    assert _versions(database.get_db(), 'test_writer').keys() >= {'after_death', 'next'}
@@ -0,0 +1,88 @@
+"""Conditional GETs for pages whose data rarely changes.
+
+Triggers keep counters per test, per test's attempts and per user in
+data_versions (see database._m008_data_versions). A page's ETag hashes the
+counters it depends on, so a refresh with a matching If-None-Match gets a
+304 after one primary key lookup per database, before the page's own
+queries or template run.
+"""
+import hashlib
+import time
+
+from flask import current_app, make_response, request, session
+
+import storage
+
+# Part of every ETag so a restart (new templates or assets) changes them all.
+_release = f"{time.time_ns():x}"
+
+# Seconds ranks and leaderboards may lag behind new attempts, see ranks_version().
+RANK_STALENESS = 30
+
+_ranks = {}     # {test_id or None: (window, attempts version read in it)}
+
+
+def _version(shard, scope, key):
+    row = shard.get_db().execute(
+        "SELECT version FROM data_versions WHERE scope = ? AND key = ?", (scope, str(key))
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def test_version(test_id):
+    """Changes with the test's row and its questions, not its attempts."""
+    shard = storage.for_test(test_id)
+    if shard is storage.MAIN:
+        return (_version(shard, 'test', test_id),)
+    return _version(storage.MAIN, 'test', test_id), _version(shard, 'test', test_id)
+
+
+def attempts_version(test_id=None):
+    """Changes with every attempt at the test, or at any test when None."""
+    if test_id is None:
+        return tuple(_version(shard, 'attempts', '*') for shard in storage.shards())
+    return (_version(storage.for_test(test_id), 'attempts', test_id),)
+
+
+def ranks_version(test_id=None):
+    """attempts_version(test_id), read at most once per RANK_STALENESS window.
+    Every submission changes the live counter, so pages showing ranks would
+    never get a 304 during an exam; this way they re-render at most once per
+    window and show ranks at most that stale."""
+    window = int(time.time() // RANK_STALENESS)
+    cached = _ranks.get(test_id)
+    if cached is None or cached[0] != window:
+        cached = _ranks[test_id] = (window, attempts_version(test_id))
+    return cached[1]
+
+
+def user_version(username):
+    """Changes with the user's row and their attempts in any shard."""
+    return tuple(_version(shard, 'user', username) for shard in storage.shards())
+
+
+def etag(*versions):
+    """ETag of the current page for the given versions, or None while flashed
+    messages are pending: the page shows them once, so it must not be reused."""
+    if session.get('_flashes'):
+        return None
+    raw = repr((_release, session.get('username'), session.get('role'), request.full_path, versions))
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def not_modified(tag):
+    """A 304 response if the client already has the page tagged `tag`, else None."""
+    if tag is None or not request.if_none_match.contains(tag):
+        return None
+    return tagged(current_app.response_class(status=304), tag)
+
+
+def tagged(response, tag):
+    """Attach `tag` to a rendered page. Pages are per user, so browsers may
+    keep them but must revalidate on every use."""
+    response = make_response(response)
+    if tag is not None:
+        response.set_etag(tag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
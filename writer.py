@@ -0,0 +1,214 @@
+import atexit
+import os
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+import database
+import metrics
+
+# Pending writes allowed before submitters are pushed back on.
+QUEUE_SIZE = 2048
+# Most writes folded into a single commit.
+MAX_BATCH = 256
+# How long a submitter waits for its write to commit, in seconds.
+SUBMIT_TIMEOUT = 30
+
+
+BATCH_SIZE = metrics.Histogram(
+    'portal_writer_batch_size', "Writes folded into each group commit.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+metrics.Callback('portal_writer_queue_depth', "Writes waiting for the writer threads.",
+                 lambda: sum(w.queue_depth() for w in list(_writers.values())))
+metrics.Callback('portal_writer_jobs_committed_total', "Writes committed by the writer threads.",
+                 lambda: sum(w.jobs_committed for w in list(_writers.values())), type='counter')
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class Writer(threading.Thread):
+    """Owns the only write connection to one database (the main one, or a
+    storage shard) and applies queued jobs in group commits. A job is a
+    callable taking the connection; each runs inside its own SAVEPOINT so one
+    failing job does not abort the rest of its batch."""
+
+    def __init__(self, shard=None, maxsize=QUEUE_SIZE, max_batch=MAX_BATCH, jobs=None):
+        super().__init__(name=f"db-writer-{shard.name}" if shard else 'db-writer', daemon=True)
+        self.shard = shard
+        self.max_batch = max_batch
+        # `jobs`: the queue of a writer this one replaces, so nothing queued is lost.
+        self._queue = jobs if jobs is not None else queue.Queue(maxsize=maxsize)
+        self._stopping = False
+        self.jobs_committed = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+
+    def submit(self, job, timeout=1.0):
+        future = Future()
+        try:
+            self._queue.put((job, future), timeout=timeout)
+        except queue.Full:
+            raise WriterBusy("Too many submissions in progress, please retry.")
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'jobs_committed': self.jobs_committed,
+            'batches': self.batches,
+            'batch_sizes': dict(self.batch_sizes),
+        }
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._queue.put((None, None))
+        self.join(timeout)
+
+    def run(self):
+        conn = None
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                jobs = [(job, future) for job, future in batch if job is not None]
+                if jobs:
+                    try:
+                        if conn is not None and self.shard is None and generation != database.generation:
+                            # The app was pointed at another database.
+                            conn = self._discard(conn)
+                        if conn is None:
+                            generation = database.generation
+                            conn = self._connect()
+                            conn.isolation_level = None  # we issue BEGIN/SAVEPOINT ourselves
+                        self._commit(conn, jobs)
+                    except Exception as e:
+                        # Fail this batch only and reconnect for the next one:
+                        # a dead writer would leave every later write hanging.
+                        print(f"⚠️ {self.name} failed a batch of {len(jobs)} writes: {e}")
+                        for _, future in jobs:
+                            if not future.done():
+                                future.set_exception(e)
+                        conn = self._discard(conn)
+                if self._stopping and self._queue.empty():
+                    break
+        finally:
+            self._discard(conn)
+
+    def _connect(self):
+        return self.shard.connect() if self.shard else database.connect()
+
+    @staticmethod
+    def _discard(conn):
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return None
+
+    def _commit(self, conn, jobs):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, job(conn), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in jobs:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.batch_sizes[len(jobs)] += 1
+        BATCH_SIZE.observe(len(jobs))
+        self.jobs_committed += len(jobs)
+        # Only report back once the whole batch is durable.
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writers = {}          # {shard: Writer}; the main database is None
+_writers_pid = None
+_lock = threading.Lock()
+
+
+def get_writer(shard=None):
+    """The writer for a database in this process, started on first use (and
+    again in a forked worker, which does not inherit the parent's threads, or
+    if the thread died, in which case its replacement takes over its queue)."""
+    global _writers, _writers_pid
+    writer = _writers.get(shard)
+    if writer is None or not writer.is_alive() or _writers_pid != os.getpid():
+        with _lock:
+            if _writers_pid != os.getpid():
+                _writers, _writers_pid = {}, os.getpid()
+            writer = _writers.get(shard)
+            if writer is None or not writer.is_alive():
+                jobs = writer._queue if writer is not None else None
+                writer = _writers[shard] = Writer(shard, jobs=jobs)
+                writer.start()
+    return writer
+
+
+def submit(job, shard=None):
+    return get_writer(shard).submit(job)
+
+
+def write(job, timeout=SUBMIT_TIMEOUT, shard=None):
+    """Queue a job and block until it is committed; returns its result."""
+    return submit(job, shard).result(timeout=timeout)
+
+
+def stats():
+    writer = _writers.get(None)
+    return writer.stats() if writer is not None else {}
+
+
+def stop(shard):
+    """Stop one shard's writer, e.g. when the shard layout is reconfigured."""
+    with _lock:
+        writer = _writers.pop(shard, None) if _writers_pid == os.getpid() else None
+    if writer is not None and writer.is_alive():
+        writer.stop()
+
+
+@atexit.register
+def shutdown():
+    """Stop this process's writers once everything queued is committed."""
+    if _writers_pid == os.getpid():
+        for writer in list(_writers.values()):
+            if writer.is_alive():
+                writer.stop()
+
+
+def _reset_after_fork():
+    # get_writer() starts new threads in the child; the lock may have been held.
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)